@@ -352,13 +352,21 @@ class BlobHelper(object):
         if hasattr(self, '_language'):
             return self._language
 
+        self._language = Language.detect(self.name, self.language_data, self.mode)
+        return self._language
+
+    @property
+    def language_data(self):
+        """
+        Internal: Get the data passed to Language.detect.
+
+        Returns the data String if it is already loaded, else a function
+        loading it lazily, which returns '' for binary blobs.
+        """
         _data = getattr(self, '_data', False)
         if _data and isinstance(_data, basestring):
-            data = _data
-        else:
-            data = lambda: '' if (self.is_binary_mime_type or self.is_binary) else self.data
-        self._language = Language.detect(self.name, data, self.mode)
-        return self._language
+            return _data
+        return lambda: '' if (self.is_binary_mime_type or self.is_binary) else self.data
 
     @property
     def lexer(self):
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+
+class LRUCache(object):
+    """
+    Bounded Hash dropping the least recently used entries.
+    """
+
+    def __init__(self, size=1024):
+        """
+        Public: Initialize an empty cache.
+
+          size - Integer maximum number of entries.
+
+        Returns a LRUCache.
+        """
+        self.size = size
+        self.clear()
+
+    def __repr__(self):
+        return '<LRUCache size:%d entries:%d>' % (self.size, len(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """
+        Public: Drop every entry and reset the counters.
+
+        Returns nothing.
+        """
+        # key => [previous link, next link, key, value], the links form a
+        # circular list from the most to the least recently used entry.
+        self.entries = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def digest(data):
+        """
+        Public: Fast digest of contents, to key entries with.
+
+          data - String contents.
+
+        Returns a String.
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        return hashlib.sha1(data).digest()
+
+    def get(self, key, default=None):
+        """
+        Public: Look up an entry, making it the most recently used.
+
+          key     - Hashable key.
+          default - Value returned for missing keys.
+
+        Returns the value or default.
+        """
+        link = self.entries.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._unlink(link)
+        self._push(link)
+        return link[3]
+
+    def set(self, key, value):
+        """
+        Public: Store an entry, dropping the least recently used one when
+        the cache is full.
+
+          key   - Hashable key.
+          value - Any value.
+
+        Returns nothing.
+        """
+        link = self.entries.get(key)
+        if link is not None:
+            self._unlink(link)
+            link[3] = value
+        else:
+            if self.size <= 0:
+                return
+            if len(self.entries) >= self.size:
+                oldest = self.root[0]
+                self._unlink(oldest)
+                del self.entries[oldest[2]]
+                self.evictions += 1
+            link = self.entries[key] = [None, None, key, value]
+        self._push(link)
+
+    def stats(self):
+        """
+        Public: Get the counters of the cache.
+
+        Returns a Hash of String counter name to Integer.
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'size': self.size}
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _push(self, link):
+        first = self.root[1]
+        link[0], link[1] = self.root, first
+        first[0] = self.root[1] = link
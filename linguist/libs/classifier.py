@@ -1,13 +1,45 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
-import math
-from functools import partial
+from collections import defaultdict
+from itertools import izip
+from operator import itemgetter
 
 is_py27 = sys.version_info >= (2, 7)
 if is_py27:
     from collections import Counter
-from tokenizer import Tokenizer
+from model import Model
+from tokenizer import BYTE_LIMIT, DATA_TYPES, READ_AHEAD, Tokenizer
+
+# Number of tokens scored between two checks of the early exit bound
+TOP_BLOCK_SIZE = 16
+
+# Relative slack given to the early exit bound for rounding errors
+TOP_EPSILON = 1e-9
+
+# Defaults of classify_early: lead in log score over the runner-up past
+# which reading stops, once that many tokens were scored
+EARLY_MARGIN = 50.0
+EARLY_MIN_TOKENS = 200
+
+
+def count_tokens(tokens):
+    """
+    Public: Collapse tokens into a Hash of token to number of occurrences.
+
+    tokens - Iterable of String tokens, or data to tokenize, see
+             Tokenizer.count_tokens.
+
+    Returns a Hash.
+    """
+    if isinstance(tokens, DATA_TYPES):
+        return Tokenizer.count_tokens(tokens)
+    if is_py27:
+        return Counter(tokens)
+    counts = defaultdict(int)
+    for token in tokens:
+        counts[token] += 1
+    return counts
 
 
 class Classifier(object):
@@ -15,11 +47,20 @@ class Classifier(object):
 
     verbosity = int(os.environ.get('LINGUIST_DEBUG', '0'))
 
+    # Optional LRUCache of results by content, see cache_key
+    cache = None
+
+    # Whether classify_many and Language.detect_many score batches with
+    # MatrixClassifier when NumPy is available.  Its dense matrix of the
+    # whole model is built in every process, next to the model they may
+    # share, so it is opt-in.
+    matrix = False
+
     @classmethod
     def train(cls, db, language, data):
         """
-        Set LINGUIST_DEBUG=1 or =2 to see probabilities per-token,
-        per-language.  See also dump_all_tokens, below.
+        Set LINGUIST_DEBUG=1 or =2 to see probabilities per-language,
+        per-token.  See also explain, below.
 
         Public: Train classifier that data is a certain language.
 
@@ -33,31 +74,195 @@ class Classifier(object):
 
           Returns nothing.
         """
-        tokens = Tokenizer.tokenize(data)
-        db['tokens_total'] = db.get('tokens_total', 0)
-        db['languages_total'] = db.get('languages_total', 0)
-        db['tokens'] = db.get('tokens', {})
-        db['language_tokens'] = db.get('language_tokens', {})
-        db['languages'] = db.get('languages', {})
+        cls.train_counts(db, language, Tokenizer.count_tokens(data))
 
-        for token in tokens:
-            db['tokens'][language] = db['tokens'].get(language, {})
-            db['tokens'][language][token] = db['tokens'][language].get(token, 0)
-            db['tokens'][language][token] += 1
-            db['language_tokens'][language] = db['language_tokens'].get(language, 0)
-            db['language_tokens'][language] += 1
-            db['tokens_total'] += 1
+    @classmethod
+    def train_counts(cls, db, language, counts):
+        """
+        Public: Train classifier with the tokens of a document, counted.
 
-        db['languages'][language] = db['languages'].get(language, 0)
-        db['languages'][language] += 1
-        db['languages_total'] += 1
+        The counts are merged into the table of the language at once, and
+        totals are updated once per document.
+
+          db       - Hash classifier database object
+          language - String language of the document
+          counts   - Hash of String token to Integer occurrences, like
+                     count_tokens gives.
+
+          Examples
+
+            Classifier.train_counts(db, 'Ruby', {'def': 1, 'hello': 1, 'end': 1})
+
+          Returns nothing.
+        """
+        size = sum(counts.itervalues())
+        db['tokens_total'] = db.get('tokens_total', 0) + size
+        db['languages_total'] = db.get('languages_total', 0) + 1
+        db.setdefault('tokens', {})
+        db.setdefault('language_tokens', {})
+        db.setdefault('languages', {})
+
+        if size:
+            tokens = db['tokens'].setdefault(language, {})
+            get = tokens.get
+            tokens.update([(token, get(token, 0) + count) for token, count in counts.iteritems()])
+            db['language_tokens'][language] = db['language_tokens'].get(language, 0) + size
+
+        db['languages'][language] = db['languages'].get(language, 0) + 1
+
+    @classmethod
+    def merge(cls, db, other):
+        """
+        Public: Add the counts of a database to another one.
+
+        Training on two sets of documents and merging the databases gives
+        the database of training on all of them.
+
+          db    - Hash classifier database object to update.
+          other - Hash classifier database object to add.
+
+          Examples
+
+            Classifier.merge(db, shard)
+
+          Returns nothing.
+        """
+        for key in ('tokens_total', 'languages_total'):
+            db[key] = db.get(key, 0) + other.get(key, 0)
+        for key in ('tokens', 'language_tokens', 'languages'):
+            db.setdefault(key, {})
+
+        for language, counts in other.get('tokens', {}).iteritems():
+            tokens = db['tokens'].setdefault(language, {})
+            get = tokens.get
+            tokens.update([(token, get(token, 0) + count) for token, count in counts.iteritems()])
+        for key in ('language_tokens', 'languages'):
+            totals = db[key]
+            for language, count in other.get(key, {}).iteritems():
+                totals[language] = totals.get(language, 0) + count
 
     def __init__(self, db={}):
-        self.tokens = db.get('tokens')
-        self.tokens_total = db.get('tokens_total')
-        self.languages = db.get('languages')
-        self.languages_total = db.get('languages_total')
-        self.language_tokens = db.get('language_tokens')
+        self.model = db if isinstance(db, Model) else Model.from_db(db)
+        # Indexes shipped in a model file are used as they are
+        self.candidate_indexes = dict(self.model.candidate_indexes)
+        # md5 of the model the candidate indexes were built for, which a
+        # FeedbackModel moves away from with every delta
+        self.candidate_md5 = self.model.md5
+        if self.candidate_indexes:
+            self.candidate_md5 = self.model.candidate_md5
+        # Sets of languages indexed the first time they are used
+        self.candidate_sets = set()
+
+    # Tables of the model are read through, so that the deltas applied to
+    # a FeedbackModel show up.
+    tokens_total = property(lambda self: self.model.tokens_total)
+    languages_total = property(lambda self: self.model.languages_total)
+    log_probabilities = property(lambda self: self.model.log_probabilities)
+    log_priors = property(lambda self: self.model.log_priors)
+    token_gaps = property(lambda self: self.model.token_gaps)
+    unseen_log_probability = property(lambda self: self.model.unseen_log_probability)
+
+    def build_candidate_indexes(self, candidate_sets):
+        """
+        Public: Precompute the discriminative tokens of candidate sets.
+
+        Within a set of candidate languages, a token with the same
+        probability in all of them (usually because none of them has seen
+        it) can't change their ranking.  The index of a set keeps every
+        other token, with the largest difference of log probability it
+        makes between two of the candidates and its log probability in
+        each of them, by token id.  classify_top skips tokens missing from
+        the index of its candidates.
+
+        Indexes are snapshots: once the model takes a delta (see
+        FeedbackModel) they are left unused until built again.  Sets
+        added to candidate_sets instead are indexed by classify_top the
+        first time it's asked to choose from one of them.
+
+        candidate_sets - Array of Arrays of language name Strings, like
+                         the ones Language.find_by_filename returns.
+
+        Returns nothing.
+        """
+        model = self.model
+        if self.candidate_md5 != model.md5:
+            self.candidate_indexes = {}
+            self.candidate_md5 = model.md5
+        offsets, posting_languages = model.offsets[:], model.posting_languages[:]
+        seen_by = defaultdict(list)
+        for token_id in xrange(model.size):
+            for i in xrange(offsets[token_id], offsets[token_id + 1]):
+                seen_by[posting_languages[i]].append(token_id)
+
+        for languages in candidate_sets:
+            languages = tuple(sorted(languages))
+            slots = self.language_slots(languages)
+            seen, index = set(), {}
+            for language_id in slots:
+                for token_id in seen_by[language_id]:
+                    if token_id in seen:
+                        continue
+                    seen.add(token_id)
+                    row = self.candidate_row(token_id, slots, len(languages))
+                    gap = max(row) - min(row)
+                    if gap:
+                        index[token_id] = (gap, row)
+            self.candidate_indexes[frozenset(languages)] = (languages, index)
+
+    def language_slots(self, languages):
+        """
+        Internal: Map the ids of languages to their position.
+
+        languages - Array of language name Strings.
+
+        Returns a Hash of Integer language id to Integer position, leaving
+        out languages missing from the model.
+        """
+        language_ids = self.model.language_ids
+        return dict([(language_ids[language], i) for i, language in enumerate(languages)
+                     if language in language_ids])
+
+    def candidate_row(self, token_id, slots, size):
+        """
+        Internal: Log probabilities of a token in candidate languages.
+
+        token_id - Integer token id.
+        slots    - Hash of language id to position, from language_slots.
+        size     - Integer number of candidates.
+
+        Returns an Array of Floats, by candidate position.
+        """
+        row = [self.unseen_log_probability] * size
+        for language_id, logp in izip(*self.model.row(token_id)):
+            slot = slots.get(language_id)
+            if slot is not None:
+                row[slot] = logp
+        return row
+
+    @classmethod
+    def load(cls, db):
+        """
+        Public: Get a Classifier for a database.
+
+        Building the probability tables is done once per generated
+        database (one carrying an 'md5', like samples.DATA), later calls
+        reuse that instance.  Other databases get a fresh Classifier.
+
+        A Model, like Samples.model(), keeps its Classifier: models used
+        side by side, like the old and new ones of Language.reload, don't
+        evict each other's.
+
+        db - Hash classifier database object or Model.
+
+        Returns a Classifier.
+        """
+        if not isinstance(db, Model):
+            if db.get('md5') is None:
+                return cls(db)
+            db = Model.load(db)
+        if db.classifier is None:
+            db.classifier = cls(db)
+        return db.classifier
 
     def __repr__(self):
         return '<Classifier>'
@@ -67,7 +272,7 @@ class Classifier(object):
         """
         Public: Guess language of data.
 
-        db        - Hash of classifer tokens database.
+        db        - Hash of classifer tokens database or Model.
         data      - Array of tokens or String data to analyze.
         languages - Array of language name Strings to restrict to.
 
@@ -79,8 +284,276 @@ class Classifier(object):
         Returns sorted Array of result pairs. Each pair contains the
         String language name and a Float score.
         """
-        languages = languages or db.get('languages', {}).keys()
-        return cls(db)._classify(tokens, languages)
+        classifier = cls.load(db)
+        languages = languages or classifier.model.languages
+        key = cls.cache_key('classify', tokens, languages, classifier.model.md5)
+        if key is None:
+            return classifier._classify(tokens, languages)
+        result = cls.cache.get(key)
+        if result is None:
+            result = classifier._classify(tokens, languages)
+            cls.cache.set(key, result)
+        return list(result)
+
+    @classmethod
+    def classify_stream(cls, db, stream, languages=[]):
+        """
+        Public: Guess language of a file object or chunks of data.
+
+        Same as classify, but the stream is only read up to the byte
+        limit of the Tokenizer, see Tokenizer.read.
+
+        db        - Hash of classifer tokens database or Model.
+        stream    - File-like object or iterable of String chunks.
+        languages - Array of language name Strings to restrict to.
+
+        Examples
+
+          Classifier.classify_stream(db, open('huge.h'), ['C', 'C++'])
+          # => [['C++', -2042.3], ['C', -2101.9]]
+
+        Returns sorted Array of result pairs. Each pair contains the
+        String language name and a Float score.
+        """
+        return cls.classify(db, Tokenizer.read(stream), languages)
+
+    @classmethod
+    def classify_early(cls, db, stream, languages=[], margin=EARLY_MARGIN,
+                       min_tokens=EARLY_MIN_TOKENS):
+        """
+        Public: Guess language of a file object or chunks of data, reading
+        only as much as it takes to be confident.
+
+        Scores are updated as tokens come from Tokenizer.stream_tokens,
+        and both tokenizing and reading stop once the leading language
+        is ahead of every other one by margin.  Gives the result of
+        classify_stream when it doesn't stop early.
+
+        db         - Hash of classifer tokens database or Model.
+        stream     - File-like object or iterable of String chunks.
+        languages  - Array of language name Strings to restrict to.
+        margin     - Float difference of log scores to stop at.
+        min_tokens - Integer number of tokens scored before stopping.
+
+        Examples
+
+          Classifier.classify_early(db, open('huge.h'), ['C', 'C++'])
+          # => ([['C++', -1203.5], ['C', -1262.0]], True)
+
+        Returns a pair of the sorted Array of result pairs, on the tokens
+        read, and whether reading stopped early.
+        """
+        classifier = cls.load(db)
+        return classifier._classify_early(Tokenizer.stream_tokens(stream),
+                                          languages or classifier.model.languages,
+                                          margin, min_tokens)
+
+    @classmethod
+    def classify_top(cls, db, tokens, languages=[]):
+        """
+        Public: Guess the most likely language of data.
+
+        Gives the same language as the first pair of classify, but stops
+        scoring as soon as no other language can catch up.
+
+        db        - Hash of classifer tokens database or Model.
+        data      - Array of tokens or String data to analyze.
+        languages - Array of language name Strings to restrict to.
+
+        Examples
+
+          Classifier.classify_top(db, "def hello; end")
+          # => 'Ruby'
+
+        Returns the String language name or None.
+        """
+        classifier = cls.load(db)
+        languages = languages or classifier.model.languages
+        key = cls.cache_key('classify_top', tokens, languages, classifier.model.md5)
+        if key is None:
+            return classifier._classify_top(tokens, languages)
+        result = cls.cache.get(key)
+        if result is None:
+            result = classifier._classify_top(tokens, languages)
+            cls.cache.set(key, result)
+        return result
+
+    @classmethod
+    def classify_many(cls, db, items):
+        """
+        Public: Guess language of many documents at once.
+
+        Items are grouped by their candidate languages and each group is
+        scored by one classifier instance, with MatrixClassifier when
+        matrix is set and NumPy is available.
+
+        db    - Hash of classifer tokens database or Model.
+        items - Array of (data, languages) pairs, data being an Array of
+                tokens or String data to analyze and languages an Array
+                of language name Strings to restrict to.
+
+        Examples
+
+          Classifier.classify_many(db, [("def hello; end", ['Ruby', 'Python']),
+                                        ("@end", ['C', 'Objective-C'])])
+          # => [[['Ruby', -8.1], ['Python', -9.5]], [['Objective-C', -5.7], ['C', -7.2]]]
+
+        Returns an Array with the sorted Array of result pairs of every
+        item, in the order of items.
+        """
+        from matrix_classifier import MatrixClassifier
+
+        if isinstance(db, Model):
+            everything, md5 = db.languages, db.md5
+        else:
+            everything, md5 = db.get('languages', {}).keys(), db.get('md5')
+        groups = {}
+        results = [None] * len(items)
+        keys = [None] * len(items)
+        for i, (tokens, languages) in enumerate(items):
+            languages = tuple(sorted(languages or everything))
+            keys[i] = cls.cache_key('classify', tokens, languages, md5)
+            if keys[i] is not None:
+                results[i] = cls.cache.get(keys[i])
+                if results[i] is not None:
+                    results[i] = list(results[i])
+                    keys[i] = None
+                    continue
+            groups.setdefault(languages, []).append(i)
+
+        if cls.matrix and MatrixClassifier.available:
+            classifier = MatrixClassifier.load(db)
+            for languages, indexes in groups.iteritems():
+                documents = [items[i][0] for i in indexes]
+                for i, result in zip(indexes, classifier.classify(documents, languages)):
+                    results[i] = result
+        else:
+            classifier = cls.load(db)
+            for languages, indexes in groups.iteritems():
+                for i in indexes:
+                    results[i] = classifier._classify(items[i][0], languages)
+
+        for key, result in zip(keys, results):
+            if key is not None:
+                cls.cache.set(key, list(result))
+        return results
+
+    @classmethod
+    def explain(cls, db, tokens, languages=[]):
+        """
+        Public: Guess language of data, and tell how.
+
+        Scores like classify, in one pass, and keeps what every token and
+        every prior made of them, as data.
+
+        db        - Hash of classifer tokens database or Model.
+        data      - Array of tokens or String data to analyze.
+        languages - Array of language name Strings to restrict to.
+
+        Examples
+
+          Classifier.explain(db, "def hello; end", ['Ruby', 'Python'])
+          # => {'languages': [('Ruby', -20.9), ('Python', -29.5)],
+          #     'priors': {'Ruby': -2.8, 'Python': -3.1},
+          #     'unseen_log_probability': -13.3, 'occurrences': 4,
+          #     'tokens': [{'token': 'end', 'count': 1,
+          #                 'points': {'Ruby': 7.2, 'Python': 1.5}}, ...]}
+
+        Returns a Hash with the sorted Array of result pairs of classify
+        as 'languages', the log prior of every language as 'priors', the
+        'unseen_log_probability' every token starts from and the number of
+        'occurrences' of tokens.  'tokens' has the 'token', its 'count'
+        and the 'points' it gave to the languages that saw it, on top of
+        unseen, of every distinct token, those setting languages apart the
+        most first.  The score of a language adds up its prior,
+        occurrences times unseen, and its points.
+        """
+        classifier = cls.load(db)
+        return classifier._explain(tokens, languages or classifier.model.languages)
+
+    @classmethod
+    def format_explanation(cls, explanation, verbosity=1):
+        """
+        Public: Render an explanation as text.
+
+        explanation - Hash from explain.
+        verbosity   - Integer, 2 to list tokens too.
+
+        Returns a String.
+        """
+        unseen = explanation['unseen_log_probability'] or 0.0
+        occurrences = explanation['occurrences']
+        lines = []
+        for language, score in explanation['languages']:
+            prior = explanation['priors'][language]
+            lines.append('%20s = %10.3f + %7.3f = %10.3f' % (language, score - prior, prior, score))
+
+        if verbosity >= 2:
+            languages = [language for language, _ in explanation['languages']]
+            width = max([len(token['token']) for token in explanation['tokens']] + [5])
+            lines.append('%*s %5s' % (width, 'token', '#') +
+                         ''.join(['%12s' % language[:11] for language in languages]))
+            for token in explanation['tokens']:
+                points = token['points']
+                if not points:
+                    continue
+                lines.append('%*s %5d' % (width, token['token'], token['count']) +
+                             ''.join(['%12.3f' % points[language] if language in points else '%12s' % '-'
+                                      for language in languages]))
+            lines.append('%d occurrences at %.3f unseen' % (occurrences, unseen))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def cache_key(cls, kind, tokens, languages, md5):
+        """
+        Internal: Key of a result in the cache.
+
+        Set Classifier.cache to a LRUCache to reuse the results of
+        classify, classify_top and classify_many on contents seen
+        before, which are then neither tokenized nor scored again.
+        Only String data is cached, against databases carrying an md5.
+
+        Data is keyed by its length and the digest of its first
+        BYTE_LIMIT + READ_AHEAD bytes, like Tokenizer.read would read
+        it, so that a large mmap isn't read whole to be looked up.  Only
+        a token, string or comment running further past BYTE_LIMIT could
+        tell apart data with the same key.
+
+        kind      - String name of the method.
+        tokens    - Array of tokens or String data to analyze.
+        languages - Array of language name Strings to restrict to.
+        md5       - String digest of the database, or None.
+
+        Returns a Tuple, or None when the result shouldn't be cached.
+        """
+        if cls.cache is None or md5 is None or not isinstance(tokens, DATA_TYPES):
+            return
+        digest = cls.cache.digest(tokens[:BYTE_LIMIT + READ_AHEAD])
+        return (kind, digest, len(tokens), tuple(sorted(languages)), md5)
+
+    def count_token_ids(self, tokens):
+        """
+        Internal: Count the tokens of data the model knows, by id.
+
+        Data is tokenized against the vocabulary of the model, unknown
+        tokens are dropped at the source, see Tokenizer.count_token_ids.
+
+        tokens - Array of tokens or String data.
+
+        Returns a pair of a Hash of Integer token id to Integer
+        occurrences, and the Integer number of occurrences of all tokens,
+        unknown ones included.
+        """
+        if isinstance(tokens, DATA_TYPES):
+            return Tokenizer.count_token_ids(tokens, self.model.token_lookup())
+        counts, occurrences = {}, 0
+        token_id = self.model.token_id
+        for token, count in count_tokens(tokens).iteritems():
+            occurrences += count
+            i = token_id(token)
+            if i is not None:
+                counts[i] = counts.get(i, 0) + count
+        return counts, occurrences
 
     def _classify(self, tokens, languages):
         """
@@ -95,21 +568,205 @@ class Classifier(object):
         if tokens is None:
             return []
 
-        if isinstance(tokens, basestring):
-            tokens = Tokenizer.tokenize(tokens)
+        if self.verbosity >= 1:
+            explanation = self._explain(tokens, languages)
+            sys.stderr.write(self.format_explanation(explanation, self.verbosity))
+            return explanation['languages']
+
+        counts, occurrences = self.count_token_ids(tokens)
+        return self._score(counts, occurrences, languages)
+
+    def _score(self, counts, occurrences, languages):
+        """
+        Internal: Score known tokens, see _classify.
+
+        counts      - Hash of Integer token id to Integer occurrences.
+        occurrences - Integer number of occurrences of all tokens,
+                      unknown ones included.
+        languages   - Array of language name Strings to restrict to.
+
+        Returns sorted Array of result pairs, like _classify.
+        """
+        # Every token scores unseen, plus what the languages that saw it
+        # make of it on top.
+        postings = self.model.row
+        unseen = self.unseen_log_probability
+        slots = self.language_slots(languages)
+        gains = [0.0] * len(languages)
+        for token_id, count in counts.iteritems():
+            for language_id, logp in izip(*postings(token_id)):
+                slot = slots.get(language_id)
+                if slot is not None:
+                    gains[slot] += count * (logp - unseen)
 
         scores = {}
-        if self.verbosity >= 2:
-            self.dump_all_tokens(tokens, languages)
-        for language in languages:
-            scores[language] = self.tokens_probability(tokens, language) + self.language_probability(language)
-            if self.verbosity >= 1:
-                print '%10s = %10.3f + %7.3f = %10.3f\n' % (language,
-                                                            self.tokens_probability(tokens, language),
-                                                            self.language_probability(language),
-                                                            scores[language])
+        for language, gain in zip(languages, gains):
+            scores[language] = occurrences * unseen + gain + self.language_probability(language)
         return sorted(scores.iteritems(), key=lambda t: t[1], reverse=True)
 
+    def _explain(self, tokens, languages):
+        """
+        Internal: Guess language of data, keeping the contributions.
+
+        Same pass as _classify, giving the same scores.
+
+        data      - Array of tokens or String data to analyze.
+        languages - Array of language name Strings to restrict to.
+
+        Returns a Hash, see explain.
+        """
+        counts = count_tokens(tokens or [])
+        token_ids, postings = self.model.token_id, self.model.row
+        unseen = self.unseen_log_probability
+        slots = self.language_slots(languages)
+        gains = [0.0] * len(languages)
+        occurrences = 0
+        explained = []
+        for token, count in counts.iteritems():
+            occurrences += count
+            points = {}
+            explained.append({'token': token, 'count': count, 'points': points})
+            token_id = token_ids(token)
+            if token_id is None:
+                continue
+            for language_id, logp in izip(*postings(token_id)):
+                slot = slots.get(language_id)
+                if slot is not None:
+                    gain = count * (logp - unseen)
+                    gains[slot] += gain
+                    points[languages[slot]] = gain
+
+        def spread(token):
+            points = token['points'].values()
+            if len(points) < len(languages):
+                points.append(0.0)
+            return max(points) - min(points)
+
+        explained.sort(key=lambda token: (-spread(token), token['token']))
+        priors = dict([(language, self.language_probability(language)) for language in languages])
+        scores = dict([(language, occurrences * unseen + total + priors[language])
+                       for language, total in zip(languages, gains)])
+        return {'languages': sorted(scores.iteritems(), key=lambda t: t[1], reverse=True),
+                'priors': priors,
+                'unseen_log_probability': unseen,
+                'occurrences': occurrences,
+                'tokens': explained}
+
+    def _classify_early(self, tokens, languages, margin, min_tokens):
+        """
+        Internal: Guess language of tokens until confident.
+
+        tokens     - Iterable of String tokens.
+        languages  - Array of language name Strings to restrict to.
+        margin     - Float difference of log scores to stop at.
+        min_tokens - Integer number of tokens scored before stopping.
+
+        Returns a pair of the sorted Array of result pairs and whether
+        tokens were left unread.
+        """
+        if not languages:
+            return [], False
+
+        slots = self.language_slots(languages)
+        token_ids, postings = self.model.token_id, self.model.row
+        unseen = self.unseen_log_probability
+        # Languages share the unseen score of every token, only what they
+        # make on top of it sets them apart.
+        gains = [self.language_probability(language) for language in languages]
+        rows = {}
+        occurrences = 0
+        stopped = False
+        for token in tokens:
+            # Checked before scoring a token, so stopping leaves tokens
+            if occurrences >= min_tokens and not occurrences % TOP_BLOCK_SIZE:
+                leader, runner_up = (sorted(gains, reverse=True) + [None])[:2]
+                if runner_up is None or leader - runner_up >= margin:
+                    stopped = True
+                    break
+
+            row = rows.get(token)
+            if row is None:
+                row = rows[token] = []
+                token_id = token_ids(token)
+                if token_id is not None:
+                    for language_id, logp in izip(*postings(token_id)):
+                        slot = slots.get(language_id)
+                        if slot is not None:
+                            row.append((slot, logp - unseen))
+            for slot, gain in row:
+                gains[slot] += gain
+            occurrences += 1
+
+        scores = [(language, occurrences * unseen + gain) for language, gain in zip(languages, gains)]
+        return sorted(scores, key=lambda t: t[1], reverse=True), stopped
+
+    def _classify_top(self, tokens, languages):
+        """
+        Internal: Guess the most likely language of data.
+
+        Candidates are scored together, token by token, starting with the
+        tokens that tell languages apart the most.  Only the tokens of the
+        candidate index are scored when one was built for the candidates,
+        see build_candidate_indexes.  The sum of the gaps of the tokens
+        left bounds how much any candidate can still gain on another, so
+        candidates falling behind the leader by more than that are
+        dropped.
+
+        data      - Array of tokens or String data to analyze.
+        languages - Array of language name Strings to restrict to.
+
+        Returns the String language name or None.
+        """
+        if tokens is None:
+            return
+        if len(languages) == 1:
+            return languages[0]
+
+        counts, occurrences = self.count_token_ids(tokens)
+        weighted = []
+        index = None
+        if self.candidate_md5 == self.model.md5:
+            candidates = frozenset(languages)
+            index = self.candidate_indexes.get(candidates)
+            if index is None and candidates in self.candidate_sets:
+                self.build_candidate_indexes([languages])
+                index = self.candidate_indexes[candidates]
+        if index is None:
+            # Rows are only looked up for the tokens actually scored
+            slots = self.language_slots(languages)
+            gaps = self.token_gaps
+            for token_id, count in counts.iteritems():
+                # Tokens scoring the same in every language can't change the rank
+                if gaps[token_id]:
+                    weighted.append((count * gaps[token_id], count, token_id))
+        else:
+            languages, entries = index
+            for token_id, count in counts.iteritems():
+                entry = entries.get(token_id)
+                if entry is not None:
+                    weighted.append((count * entry[0], count, entry[1]))
+        weighted.sort(key=itemgetter(0), reverse=True)
+
+        remaining = sum([weight for weight, _, _ in weighted], 0.0)
+        scores = [self.language_probability(language) for language in languages]
+        alive = range(len(languages))
+
+        for start in xrange(0, len(weighted) + 1, TOP_BLOCK_SIZE):
+            for weight, count, row in weighted[start:start + TOP_BLOCK_SIZE]:
+                remaining -= weight
+                if index is None:
+                    row = self.candidate_row(row, slots, len(languages))
+                for i in alive:
+                    scores[i] += count * row[i]
+            leader = max([scores[i] for i in alive])
+            threshold = leader - max(remaining, 0.0) - TOP_EPSILON * (1 + abs(leader))
+            alive = [i for i in alive if scores[i] >= threshold]
+            if len(alive) == 1:
+                return languages[alive[0]]
+
+        # Too close to call, rank exactly like classify does
+        return self._score(counts, occurrences, languages)[0][0]
+
     def tokens_probability(self, tokens, language):
         """
         Internal: Probably of set of tokens in a language occuring - P(D | C)
@@ -119,8 +776,28 @@ class Classifier(object):
 
         Returns Float between 0.0 and 1.0.
         """
-        token_probability = partial(self.token_probability, language=language)
-        return reduce(lambda x, y: x + math.log(token_probability(y)), tokens, 0.0)
+        return self.counts_probability(count_tokens(tokens), language)
+
+    def counts_probability(self, counts, language):
+        """
+        Internal: Same as tokens_probability, for collapsed tokens.
+
+        Every distinct token is scored once, weighted by its number of
+        occurrences.
+
+        counts   - Hash of String token to Integer occurrences.
+        language - Language to check.
+
+        Returns Float log probability.
+        """
+        token_ids, posting = self.model.token_id, self.model.posting
+        language_id = self.model.language_ids.get(language)
+        logps, unseen = self.log_probabilities, self.unseen_log_probability
+        probability = 0.0
+        for token, count in counts.iteritems():
+            i = posting(token_ids(token), language_id)
+            probability += count * (unseen if i is None else logps[i])
+        return probability
 
     def token_probability(self, token, language=''):
         """
@@ -131,11 +808,12 @@ class Classifier(object):
 
         Returns Float between 0.0 and 1.0.
         """
-        probability = float(self.tokens.get(language, {}).get(token, 0))
+        probability = float(self.model.count(token, language))
         if probability == 0.0:
             return 1 / float(self.tokens_total)
         else:
-            return probability / float(self.language_tokens[language])
+            language_id = self.model.language_ids[language]
+            return probability / float(self.model.language_tokens[language_id])
 
     def language_probability(self, language):
         """
@@ -145,40 +823,4 @@ class Classifier(object):
 
         Returns Float between 0.0 and 1.0.
         """
-        return math.log(float(self.languages[language]) / float(self.languages_total))
-
-    def dump_all_tokens(self, tokens, languages):
-        """
-        Internal: show a table of probabilities for each <token,language> pair.
-
-        The number in each table entry is the number of "points" that each
-        token contributes toward the belief that the file under test is a
-        particular language.  Points are additive.
-
-        Points are the number of times a token appears in the file, times
-        how much more likely (log of probability ratio) that token is to
-        appear in one language vs.  the least-likely language.  Dashes
-        indicate the least-likely language (and zero points) for each token.
-        """
-        maxlen = max([len(token) for token in tokens])
-
-        print '%ss' % maxlen
-        print '    #' + ''.join(['%10s' for lang in languages])
-
-        if not is_py27:
-            return
-
-        tokmap = Counter(tokens)
-        for tok, count in tokmap.most_common():
-            arr = [(lang, self.token_probability(tok, lang)) for lang in languages]
-            minlen = min([n for lang, n in arr])
-            minlog = math.log(minlen)
-
-            if not reduce(lambda x, y: x and y[1] == arr[0][1], arr, True):
-                print '%*s%5d' % (maxlen, tok, count)
-
-                for ent in arr:
-                    if ent[1] == minlen:
-                        print '         -'
-                    else:
-                        print '%10.3f' % (math.log(ent[1]) - minlog)
+        return self.log_priors[self.model.language_ids[language]]
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+import tempfile
+import time
+from os.path import getsize
+
+from classifier import Classifier, count_tokens
+from md5 import MD5
+from model import Model, compact
+from samples import Samples
+from tokenizer import Tokenizer
+
+"""
+Vocabulary pruning of the classifier database.
+
+Most tokens of the samples are one-off identifiers: they take memory and
+lookups, but rarely change a decision.  Compaction drops tokens by count
+or information gain and measures what that costs: model size, scoring
+throughput and leave-one-out accuracy on the samples.
+"""
+
+
+class Compaction(object):
+    """ Prune a classifier database and report on the result. """
+
+    def __repr__(self):
+        return '<Compaction>'
+
+    @classmethod
+    def prune(cls, db, min_count=1, max_tokens=None):
+        """
+        Public: Drop tokens from a classifier database.
+
+        Language totals are left alone, so the remaining tokens keep their
+        probabilities and dropped tokens score like unknown ones.
+
+        db         - Hash classifier database object.
+        min_count  - Integer number of times a token must be seen, across
+                     all languages, to be kept.
+        max_tokens - Optional Integer number of tokens to keep, the ones
+                     with the highest information gain.
+
+        Returns a new Hash classifier database.
+        """
+        kept = cls.keep(db.get('language_tokens', {}), cls.postings(db), min_count, max_tokens)
+        pruned = dict(db)
+        pruned['tokens'] = dict([(language, dict([(token, count) for token, count in tokens.iteritems()
+                                                  if compact(token) in kept]))
+                                 for language, tokens in db.get('tokens', {}).iteritems()])
+        pruned.pop('md5', None)
+        pruned['md5'] = MD5.hexdigest(pruned)
+        return pruned
+
+    @classmethod
+    def keep(cls, language_tokens, postings, min_count=1, max_tokens=None):
+        """
+        Internal: Tokens prune keeps.
+
+        language_tokens - Hash of language name to Integer number of tokens.
+        postings        - Hash of token to counts, from postings.
+        min_count       - Integer number of times a token must be seen.
+        max_tokens      - Optional Integer number of tokens to keep.
+
+        Returns a Set of String tokens.
+        """
+        kept = set([token for token, counts in postings.iteritems()
+                    if sum([count for _, count in counts]) >= min_count])
+        if max_tokens is not None and len(kept) > max_tokens:
+            gains = cls.gains(language_tokens, postings)
+            ranked = sorted(kept, key=lambda token: (-gains[token], token))
+            kept = set(ranked[:max_tokens])
+        return kept
+
+    @classmethod
+    def postings(cls, db):
+        """
+        Internal: Counts of every token of a database, by language.
+
+        Returns a Hash of String token to Array of (language, Integer
+        count) pairs.
+        """
+        postings = {}
+        for language, tokens in db.get('tokens', {}).iteritems():
+            for token, count in tokens.iteritems():
+                if count:
+                    postings.setdefault(compact(token), []).append((language, count))
+        return postings
+
+    @classmethod
+    def information_gains(cls, db):
+        """
+        Public: Information gain of every token about the language.
+
+        Every token occurrence of the samples is an event: the gain of a
+        token is how much knowing whether an occurrence is that token
+        lowers the entropy of its language.
+
+        db - Hash classifier database object.
+
+        Returns a Hash of String token to Float gain, in nats.
+        """
+        return cls.gains(db.get('language_tokens', {}), cls.postings(db))
+
+    @classmethod
+    def gains(cls, language_tokens, postings):
+        """
+        Internal: Information gain of every token of postings, see
+        information_gains.
+
+        language_tokens - Hash of language name to Integer number of tokens.
+        postings        - Hash of token to counts, from postings.
+
+        Returns a Hash of String token to Float gain, in nats.
+        """
+        total = float(sum(language_tokens.values()))
+        if not total:
+            return {}
+
+        def xlogx(x):
+            return x * math.log(x) if x > 0 else 0.0
+
+        # Sum of x log x over the language totals, tokens only change the
+        # terms of the languages that saw them.
+        base = sum([xlogx(count) for count in language_tokens.itervalues()])
+        entropy = math.log(total) - base / total
+        terms = dict([(language, xlogx(count)) for language, count in language_tokens.iteritems()])
+
+        gains = {}
+        for token, counts in postings.iteritems():
+            seen = float(sum([count for _, count in counts]))
+            unseen = total - seen
+            inside = sum([xlogx(count) for _, count in counts])
+            outside = base + sum([xlogx(language_tokens[language] - count) - terms[language]
+                                  for language, count in counts])
+            conditional = (xlogx(seen) - inside + xlogx(unseen) - outside) / total
+            gains[token] = entropy - conditional
+        return gains
+
+    @classmethod
+    def documents(cls):
+        """
+        Public: Token counts of every sample.
+
+        Returns an Array of Hashes with the 'language', the 'extname' or
+        'filename', the 'tokens' and the 'counts' Hash of String token to
+        Integer of every sample.
+        """
+        documents = []
+
+        def _read(sample):
+            document = dict(sample)
+            document['tokens'] = Tokenizer.tokenize(open(sample['path']).read())
+            document['counts'] = count_tokens(document['tokens'])
+            documents.append(document)
+
+        Samples.each(_read)
+        return documents
+
+    @classmethod
+    def candidates(cls, db, document):
+        """
+        Internal: Languages sharing the extension or filename of a sample.
+
+        Returns a sorted Array of language name Strings.
+        """
+        if document.get('filename'):
+            key, name = 'filenames', document['filename']
+        else:
+            key, name = 'extnames', document.get('extname')
+        return sorted([language for language, names in db.get(key, {}).iteritems() if name in names])
+
+    @classmethod
+    def leave_one_out(cls, db, documents, min_count=1, max_tokens=None):
+        """
+        Public: Leave-one-out accuracy of pruning a database, on samples.
+
+        Every sample is classified by the database it was trained into,
+        minus its own counts, among the languages sharing its extension or
+        filename, and among all languages.  The database is pruned inside
+        every fold, on the counts without the sample, so a sample never
+        decides which of its own tokens are kept.
+
+        db         - Hash classifier database object the samples were
+                     trained into, unpruned.
+        documents  - Array of samples, from documents.
+        min_count  - Integer number of times a token must be seen, see
+                     prune.
+        max_tokens - Optional Integer number of tokens to keep, see prune.
+                     The information gains of all tokens are computed
+                     again in every fold, which takes a while.
+
+        Returns a Hash of 'ambiguous' and 'all' (correct, total) pairs.
+        """
+        model = Model.from_db(db)
+        languages = model.languages
+        all_ids = range(len(languages))
+        postings = cls.postings(db)
+        totals = dict([(token, sum([count for _, count in counts])) for token, counts in postings.iteritems()])
+
+        results = {'ambiguous': [0, 0], 'all': [0, 0]}
+        for document in documents:
+            own = model.language_ids[document['language']]
+            size = sum(document['counts'].itervalues())
+            tokens_total = model.tokens_total - size
+            languages_total = float(model.languages_total - 1)
+            unseen = math.log(1 / float(tokens_total)) if tokens_total else 0.0
+            kept = cls.fold_keep(db, postings, totals, document, min_count, max_tokens)
+
+            # Tokens scoring unseen everywhere are left out, they can't
+            # change the ranking.
+            language_tokens = list(model.language_tokens)
+            language_tokens[own] -= size
+            language_counts = list(model.language_counts)
+            language_counts[own] -= 1
+            scores = [math.log(count / languages_total) if count > 0 else float('-inf')
+                      for count in language_counts]
+            for token, occurrences in document['counts'].iteritems():
+                token_id = model.token_id(token)
+                if token_id is None or (kept is not None and compact(token) not in kept):
+                    continue
+                for i in xrange(model.offsets[token_id], model.offsets[token_id + 1]):
+                    language_id = model.posting_languages[i]
+                    count = model.posting_counts[i]
+                    if language_id == own:
+                        count -= occurrences
+                    if count > 0:
+                        logp = math.log(count / float(language_tokens[language_id]))
+                        scores[language_id] += occurrences * (logp - unseen)
+
+            candidates = [model.language_ids[language] for language in cls.candidates(db, document)
+                          if language in model.language_ids]
+            for key, ids in (('all', all_ids), ('ambiguous', candidates)):
+                if len(ids) < 2:
+                    continue
+                best = max(ids, key=lambda language_id: (scores[language_id], -language_id))
+                results[key][0] += best == own
+                results[key][1] += 1
+        return dict([(key, tuple(value)) for key, value in results.iteritems()])
+
+    @classmethod
+    def fold_keep(cls, db, postings, totals, document, min_count=1, max_tokens=None):
+        """
+        Internal: Tokens of a sample prune keeps once the sample is taken
+        out of the database.
+
+        db       - Hash classifier database object.
+        postings - Hash of token to counts of the database, from postings.
+        totals   - Hash of token to Integer count across all languages.
+        document - Sample, from documents.
+
+        Returns a Set of String tokens, or None when every token is kept.
+        """
+        language = document['language']
+        counts = dict([(compact(token), count) for token, count in document['counts'].iteritems()])
+        if max_tokens is None:
+            if min_count <= 1:
+                return None
+            return set([token for token, count in counts.iteritems()
+                        if totals.get(token, 0) - count >= min_count])
+
+        language_tokens = dict(db.get('language_tokens', {}))
+        language_tokens[language] -= sum(counts.itervalues())
+        fold = dict(postings)
+        for token, count in counts.iteritems():
+            if token not in fold:
+                continue
+            rest = [(other, n - count if other == language else n) for other, n in fold[token]]
+            rest = [(other, n) for other, n in rest if n > 0]
+            if rest:
+                fold[token] = rest
+            else:
+                del fold[token]
+        return cls.keep(language_tokens, fold, min_count, max_tokens) & set(counts)
+
+    @classmethod
+    def throughput(cls, db, documents):
+        """
+        Public: Scoring speed of a database.
+
+        Every sample is classified among all languages.
+
+        db        - Hash classifier database object.
+        documents - Array of samples, from documents.
+
+        Returns a pair of Float samples and tokens per second.
+        """
+        classifier = Classifier(db)
+        languages = classifier.model.languages
+        start = time.time()
+        for document in documents:
+            classifier._classify(document['tokens'], languages)
+        elapsed = max(time.time() - start, 1e-9)
+        return (len(documents) / elapsed,
+                sum([len(document['tokens']) for document in documents]) / elapsed)
+
+    @classmethod
+    def size(cls, db):
+        """
+        Public: Size of a database.
+
+        Returns a Hash of the number of 'tokens', of 'postings' and of
+        'bytes' of the binary model file.
+        """
+        model = Model.from_db(db)
+        fd, path = tempfile.mkstemp(suffix='.model')
+        os.close(fd)
+        try:
+            model.dump(path)
+            size = getsize(path)
+        finally:
+            os.remove(path)
+        return {'tokens': model.size, 'postings': len(model.posting_counts), 'bytes': size}
+
+    @classmethod
+    def report(cls, settings, db=None, documents=None):
+        """
+        Public: Compare pruned databases with the unpruned one.
+
+        settings  - Array of (min_count, max_tokens) pairs to prune with.
+        db        - Optional Hash classifier database, defaults to
+                    Samples.data().
+        documents - Optional Array of samples, defaults to documents().
+
+        Returns an Array of Hashes with the 'min_count', 'max_tokens',
+        size, 'samples_per_second', 'tokens_per_second', 'ambiguous' and
+        'all' accuracies of every database, the unpruned one first.
+        """
+        db = db or Samples.data()
+        documents = documents or cls.documents()
+        rows = []
+        for min_count, max_tokens in [(1, None)] + list(settings):
+            pruned = cls.prune(db, min_count, max_tokens)
+            row = {'min_count': min_count, 'max_tokens': max_tokens}
+            row.update(cls.size(pruned))
+            row['samples_per_second'], row['tokens_per_second'] = cls.throughput(pruned, documents)
+            row.update(cls.leave_one_out(db, documents, min_count, max_tokens))
+            rows.append(row)
+        return rows
+
+    @classmethod
+    def format_report(cls, rows):
+        """
+        Public: Render a report as a text table.
+
+        Returns a String.
+        """
+        lines = ['%-22s %8s %9s %10s %9s %16s %16s' % ('model', 'tokens', 'postings', 'bytes',
+                                                      'samples/s', 'ambiguous', 'all')]
+        for row in rows:
+            name = 'min_count=%d' % row['min_count']
+            if row['max_tokens'] is not None:
+                name += ',max=%d' % row['max_tokens']
+
+            def accuracy(pair):
+                return '%.3f (%d/%d)' % (pair[0] / float(pair[1] or 1), pair[0], pair[1])
+
+            lines.append('%-22s %8d %9d %10d %9.1f %16s %16s' % (name, row['tokens'], row['postings'],
+                                                                 row['bytes'], row['samples_per_second'],
+                                                                 accuracy(row['ambiguous']),
+                                                                 accuracy(row['all'])))
+        return '\n'.join(lines)
@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import math
+from array import array
+from itertools import izip
+from os.path import exists
+
+from classifier import count_tokens
+from model import Model, HashedModel, compact
+
+"""
+Online updates of a loaded classifier model.
+
+A FeedbackModel sits on top of a loaded Model, usually the MappedModel of
+the samples, and takes train and untrain deltas: a corrected detection is
+learnt without generating the samples again nor restarting.
+
+The tables used for scoring are kept up to date incrementally.  Language
+priors and the unseen log probability are recomputed, they are a handful
+of numbers.  Only the rows of the tokens a delta touches are held in
+memory, with their counts.  The other rows are read from the base model,
+and the log probabilities of a language whose total changed are moved by
+the log ratio of its totals, one addition per posting.
+
+Deltas can be appended to a log file as they come, which is replayed
+when the model is opened again.
+"""
+
+
+class FeedbackModel(Model):
+    """ Model taking train and untrain deltas on top of another one. """
+
+    def __init__(self, base, path=None):
+        """
+        Public: Initialize a FeedbackModel over a loaded Model.
+
+        base - Model the deltas apply to, left untouched.
+        path - Optional String path of a delta log.  Deltas already in
+               the log are replayed, new ones are appended to it.
+
+        Returns a FeedbackModel.
+        """
+        self.base = base
+        self.hashed = base.hashed
+        self.languages = list(base.languages)
+        self.language_ids = dict(base.language_ids)
+        self.language_counts = array('l', base.language_counts)
+        self.language_tokens = array('l', base.language_tokens)
+        self.log_priors = array('d', base.log_priors)
+        self.tokens_total = base.tokens_total
+        self.languages_total = base.languages_total
+        self.unseen_log_probability = base.unseen_log_probability
+        self.size = base.size
+        self.md5 = base.md5
+        self.metadata = base.metadata
+        # The indexes of the base are only used until a delta comes, see
+        # Classifier.build_candidate_indexes
+        self.candidate_indexes = base.candidate_indexes
+        self.candidate_md5 = base.candidate_md5
+
+        # Tokens the base model doesn't know, by id past its own
+        self.added = []
+        self.vocabulary = {}
+        # token id => {language id: count}, for the tokens deltas touched
+        self.rows = {}
+        # Log ratio of the base total of tokens of a language to its
+        # current one, added to the log probabilities of base rows
+        self.shifts = array('d', [0.0]) * len(self.languages)
+        self.shifted = False
+        # Largest move of a log probability of a base row, bounds how
+        # much its gap may have changed
+        self.slack = 0.0
+        self.token_gaps = Gaps(self)
+        self.deltas = []
+        self._tables = base
+
+        self.path = None
+        if path is not None and exists(path):
+            self.replay(path)
+        self.path = path
+
+    def __repr__(self):
+        return '<FeedbackModel %r deltas:%d>' % (self.base, len(self.deltas))
+
+    def train(self, language, data):
+        """
+        Public: Learn that data is a certain language.
+
+          language - String language of data
+          data     - String contents of file, or Array of tokens
+
+          Examples
+
+            model.train('Ruby', "def hello; end")
+
+          Returns nothing.
+        """
+        self.update(language, count_tokens(data), 1)
+
+    def untrain(self, language, data):
+        """
+        Public: Take back a document trained as a certain language.
+
+        The document must have been trained as that language, by the
+        samples or by train.
+
+          language - String language of data
+          data     - String contents of file, or Array of tokens
+
+          Examples
+
+            model.untrain('Perl', prolog_file_contents)
+
+          Returns nothing.
+        """
+        self.update(language, count_tokens(data), -1)
+
+    def update(self, language, counts, sign=1):
+        """
+        Public: Apply a delta.
+
+        Nothing changes when an untrain delta is refused, or when the
+        delta can't be written to the log.
+
+        language - String language name.
+        counts   - Hash of String token to Integer occurrences, like
+                   count_tokens gives.
+        sign     - 1 to train, -1 to untrain.
+
+        Raises ValueError when untraining counts the language doesn't have,
+        or its last document.
+
+        Returns nothing.
+        """
+        if sign not in (1, -1):
+            raise ValueError('sign must be 1 or -1')
+        language = compact(language)
+        counts = dict([(compact(token), count) for token, count in counts.iteritems() if count])
+        language_id = self.language_ids.get(language)
+
+        if sign < 0:
+            if language_id is None or self.language_counts[language_id] < 2:
+                raise ValueError("can't untrain the last document of %s" % language)
+            for token, count in counts.iteritems():
+                if self.count(token, language) < count:
+                    raise ValueError("%s didn't see %r %d times" % (language, token, count))
+
+        # The md5 of the model chains the deltas, a sorted repr of one is
+        # much cheaper to digest than the Hashes themselves
+        md5 = hashlib.md5(repr((self.md5, sign, language, sorted(counts.iteritems())))).hexdigest()
+        if self.path is not None:
+            # The line is written before anything changes, a delta that
+            # can't be logged isn't applied
+            line = json.dumps([sign, language, encode_tokens(counts), md5]) + '\n'
+            f = open(self.path, 'a')
+            try:
+                f.write(line)
+            finally:
+                f.close()
+
+        if language_id is None:
+            language_id = self.add_language(language)
+
+        size = sum(counts.itervalues())
+        self.language_counts[language_id] += sign
+        self.languages_total += sign
+        self.language_tokens[language_id] += sign * size
+        self.tokens_total += sign * size
+
+        base_size = self.base.size
+        for token, count in counts.iteritems():
+            token_id = self.token_id(token)
+            if token_id is None:
+                token_id = self.add_token(token)
+            row = self.rows.get(token_id)
+            if row is None:
+                row = {}
+                if token_id < base_size:
+                    row.update(izip(*self.base.row_counts(token_id)))
+                self.rows[token_id] = row
+            count = row.get(language_id, 0) + sign * count
+            if count:
+                row[language_id] = count
+            else:
+                del row[language_id]
+
+        self.refresh(language_id)
+        self.md5 = md5
+        self.deltas.append((sign, language, counts))
+        self._tables = None
+
+    def refresh(self, language_id):
+        """
+        Internal: Update the scoring tables after a delta to a language.
+
+        Returns nothing.
+        """
+        log = math.log
+        languages_total = float(self.languages_total)
+        self.log_priors = array('d', [log(count / languages_total) for count in self.language_counts])
+        self.unseen_log_probability = None
+        if self.tokens_total:
+            self.unseen_log_probability = log(1 / float(self.tokens_total))
+
+        if language_id < len(self.base.languages):
+            before, after = self.base.language_tokens[language_id], self.language_tokens[language_id]
+            self.shifts[language_id] = log(before / float(after)) if before and after else 0.0
+        self.shifted = any(self.shifts)
+        self.slack = max([abs(shift) for shift in self.shifts] + [0.0])
+        if self.base.unseen_log_probability is not None and self.unseen_log_probability is not None:
+            self.slack = max(self.slack, abs(self.unseen_log_probability -
+                                             self.base.unseen_log_probability))
+
+    def add_language(self, language):
+        """
+        Internal: Give an id to a language the base model doesn't know.
+
+        Returns the Integer language id.
+        """
+        language_id = self.language_ids[language] = len(self.languages)
+        self.languages.append(language)
+        self.language_counts.append(0)
+        self.language_tokens.append(0)
+        self.shifts.append(0.0)
+        return language_id
+
+    def add_token(self, token):
+        """
+        Internal: Give an id to a token the base model doesn't know.
+
+        Returns the Integer token id.
+        """
+        token_id = self.vocabulary[token] = self.size
+        self.added.append(token)
+        self.size += 1
+        return token_id
+
+    def replay(self, path):
+        """
+        Internal: Apply the deltas of a log, checking every digest.
+
+        path - String path of a delta log.
+
+        Raises ValueError when the log doesn't match the model.
+
+        Returns nothing.
+        """
+        for line in open(path):
+            sign, language, counts, md5 = json.loads(line)
+            self.update(language, decode_tokens(counts), sign)
+            if self.md5 != md5:
+                raise ValueError('%s was logged against another model' % path)
+
+    def token(self, token_id):
+        """
+        Public: Get a token by id.
+
+        Returns a String.
+        """
+        if token_id < self.base.size:
+            return self.base.token(token_id)
+        return self.added[token_id - self.base.size]
+
+    def token_id(self, token):
+        """
+        Public: Get the id of a token.
+
+        token - String token.
+
+        Returns an Integer, or None for unknown tokens.
+        """
+        if isinstance(token, unicode):
+            token = token.encode('utf-8')
+        token_id = self.base.token_id(token)
+        if token_id is None:
+            return self.vocabulary.get(token)
+        return token_id
+
+    def token_lookup(self):
+        """
+        Public: Get what Tokenizer.count_token_ids looks tokens up in.
+
+        Returns the token_id function, tokens are found in the base model
+        first.
+        """
+        return self.token_id
+
+    def row(self, token_id):
+        """
+        Internal: Get the postings of a token.
+
+        token_id - Integer token id.
+
+        Returns a pair of Arrays, the language ids that saw the token and
+        the matching log probabilities.
+        """
+        row = self.rows.get(token_id)
+        if row is None:
+            languages, logps = self.base.row(token_id)
+            if self.shifted:
+                shifts = self.shifts
+                logps = [logp + shifts[language_id] for language_id, logp in izip(languages, logps)]
+            return languages, logps
+        log, totals = math.log, self.language_tokens
+        languages = sorted(row)
+        return languages, [log(row[language_id] / float(totals[language_id])) for language_id in languages]
+
+    def row_counts(self, token_id):
+        """
+        Internal: Get the postings of a token, with their counts.
+
+        token_id - Integer token id.
+
+        Returns a pair of Arrays, the language ids that saw the token and
+        the number of times they saw it.
+        """
+        row = self.rows.get(token_id)
+        if row is None:
+            return self.base.row_counts(token_id)
+        languages = sorted(row)
+        return languages, [row[language_id] for language_id in languages]
+
+    def gap(self, token_id):
+        """
+        Internal: Largest difference of log probability a token makes
+        between two languages, see Model.build_tables.
+
+        Returns a Float.
+        """
+        languages, logps = self.row(token_id)
+        if not len(logps):
+            return 0.0
+        floor = min(logps) if len(logps) == len(self.languages) else self.unseen_log_probability
+        return max(logps) - floor
+
+    def count(self, token, language):
+        """
+        Public: Number of times a language saw a token.
+
+        token    - String token.
+        language - String language name.
+
+        Returns an Integer.
+        """
+        token_id, language_id = self.token_id(token), self.language_ids.get(language)
+        if token_id is None or language_id is None:
+            return 0
+        return dict(izip(*self.row_counts(token_id))).get(language_id, 0)
+
+    def freeze(self):
+        """
+        Public: Build the deltas into a Model with tables of its own.
+
+        This is a full rebuild, for the consumers of whole tables (the
+        candidate indexes of Classifier, MatrixClassifier, dump) rather
+        than for scoring.
+
+        Returns a Model, or a HashedModel over a hashed base.
+        """
+        offsets = array('l', [0])
+        posting_languages, posting_counts = array('H'), array('l')
+        for token_id in xrange(self.size):
+            languages, counts = self.row_counts(token_id)
+            posting_languages.extend(languages)
+            posting_counts.extend(counts)
+            offsets.append(len(posting_counts))
+
+        columns = (list(self.languages), array('l', self.language_counts), array('l', self.language_tokens))
+        if self.hashed:
+            model = HashedModel(*(columns + (self.size, offsets, posting_languages,
+                                             posting_counts, self.md5)))
+        else:
+            tokens = [self.token(token_id) for token_id in xrange(self.size)]
+            model = Model(*(columns + (tokens, offsets, posting_languages, posting_counts, self.md5)))
+        model.metadata = self.metadata
+        return model
+
+    def tables(self):
+        """
+        Internal: Get the Model holding the whole tables, the base model
+        until a delta comes, then a frozen one.
+
+        Returns a Model.
+        """
+        if self._tables is None:
+            self._tables = self.freeze()
+        return self._tables
+
+    offsets = property(lambda self: self.tables().offsets)
+    posting_languages = property(lambda self: self.tables().posting_languages)
+    posting_counts = property(lambda self: self.tables().posting_counts)
+    log_probabilities = property(lambda self: self.tables().log_probabilities)
+
+    def dump(self, path, candidate_indexes={}):
+        """
+        Public: Write the model, deltas built in, to a binary file
+        MappedModel can open.
+
+        path              - String path of the file.
+        candidate_indexes - Optional Hash of the candidate indexes of a
+                            Classifier of this model, to ship with it.
+
+        Returns nothing.
+        """
+        self.tables().dump(path, candidate_indexes)
+
+
+def encode_tokens(counts):
+    """
+    Internal: Get the token counts of a delta in a form JSON keeps.
+
+    Tokens are bytes, UTF-8 or not, each byte is kept as the character
+    of the same code point.
+
+    Returns a Hash of unicode token to Integer occurrences.
+    """
+    return dict([(token.decode('latin-1'), count) for token, count in counts.iteritems()])
+
+
+def decode_tokens(counts):
+    """
+    Internal: Get back the token counts encode_tokens gave.
+
+    Returns a Hash of String token to Integer occurrences.
+    """
+    return dict([(token.encode('latin-1'), count) for token, count in counts.iteritems()])
+
+
+class Gaps(object):
+    """
+    Token gaps of a FeedbackModel.
+
+    The gap of a row the deltas touched is computed again.  Every log
+    probability of another row moved by at most the slack of the model,
+    so its base gap plus twice the slack is an upper bound of its gap,
+    which is all classify_top needs.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __len__(self):
+        return self.model.size
+
+    def __getitem__(self, token_id):
+        model = self.model
+        if token_id in model.rows or len(model.languages) > len(model.base.languages):
+            # A language of its own doesn't see base tokens, their floor
+            # moves to the unseen log probability
+            return model.gap(token_id)
+        return model.base.token_gaps[token_id] + 2 * model.slack
@@ -11,7 +11,7 @@ from pygments import highlight
 from pygments.formatters import HtmlFormatter
 
 from classifier import Classifier
-from samples import DATA
+from samples import MODEL_PATH, Samples
 
 DIR = dirname(realpath(__file__))
 POPULAR_PATH = join(DIR, "popular.yml")
@@ -233,16 +233,8 @@ class Language(object):
           mode - Optional String mode (defaults to nil)
 
         Returns Language or nil.
-
-        A bit of an elegant hack. If the file is executable but
-        extensionless, append a "magic" extension so it can be
-        classified with other languages that have shebang scripts.
         """
-        extname = splitext(name)[1]
-        if not extname and mode and (int(mode, 8) & 05 == 05):
-            name += ".script!"
-
-        possible_languages = cls.find_by_filename(name)
+        possible_languages = cls.find_by_blob(name, mode)
 
         if not possible_languages:
             return
@@ -254,10 +246,182 @@ class Language(object):
         if data is None or data == "":
             return
 
-        _pns = [p.name for p in possible_languages]
-        result = Classifier.classify(DATA, data, _pns)
+        # The model is taken once, a reload during the call doesn't
+        # change it; languages it doesn't know can't be scored
+        model = cls.classifier_db()
+        _pns = [p.name for p in possible_languages if p.name in model.language_ids]
+        if not _pns:
+            return
+        result = Classifier.classify_top(model, data, _pns)
         if result:
-            return cls[result[0][0]]
+            return cls[result]
+
+    @classmethod
+    def detect_many(cls, blobs):
+        """
+        Public: Detects the Languages of many blobs at once.
+
+          blobs - Array of (name, data, mode) tuples, taking the same
+                  values as detect.
+
+        Blobs that need the classifier are classified in one batch when
+        Classifier.matrix is set, else one by one like detect does.
+
+        Returns an Array of Language or nil, in the order of blobs.
+        """
+        results = [None] * len(blobs)
+        pending, items = [], []
+        model = None
+        for i, (name, data, mode) in enumerate(blobs):
+            possible_languages = cls.find_by_blob(name, mode)
+            if len(possible_languages) == 1:
+                results[i] = possible_languages[0]
+            elif possible_languages:
+                data = data() if callable(data) else data
+                if data is None or data == "":
+                    continue
+                # One model for the whole batch, see detect
+                if model is None:
+                    model = cls.classifier_db()
+                _pns = [p.name for p in possible_languages if p.name in model.language_ids]
+                if not _pns:
+                    continue
+                if not Classifier.matrix:
+                    result = Classifier.classify_top(model, data, _pns)
+                    if result:
+                        results[i] = cls[result]
+                    continue
+                pending.append(i)
+                items.append((data, _pns))
+
+        if not items:
+            return results
+        for i, result in zip(pending, Classifier.classify_many(model, items)):
+            if result:
+                results[i] = cls[result[0][0]]
+        return results
+
+    @classmethod
+    def classifier_db(cls):
+        """
+        Internal: Get the classifier model of the samples.
+
+        The model is loaded on first call: detecting by extension or
+        filename alone never pays for it.  samples.model ships the
+        candidate indexes; those missing from another model file are
+        built the first time their set is detected from.
+
+        Returns a Model.
+        """
+        model = Samples.model()
+        classifier = Classifier.load(model)
+        if not classifier.candidate_sets:
+            classifier.candidate_sets.update([frozenset(languages) for languages in cls.candidate_sets()])
+        return model
+
+    @classmethod
+    def reload(cls, path=MODEL_PATH, md5=None):
+        """
+        Public: Switch to another model file without restarting.
+
+        The file is checked (see Samples.open), then the extension and
+        filename indexes are rebuilt with its extnames and filenames, and
+        the candidate indexes of its Classifier built, all on the side.
+        Only then are the model and indexes swapped in, so detection
+        never waits for a cold model.
+
+          path - String path of a file written by Samples.generate or
+                 Samples.publish.
+          md5  - Optional String md5 the model must have.
+
+        Examples
+
+          Language.reload('/srv/linguist/samples.model', '5d6b...')
+          # => <MappedModel languages:96 tokens:29886>
+
+        Raises ValueError when the file doesn't check out, nothing is
+        swapped then.
+
+        Returns the new Model.
+        """
+        model = Samples.open(path, md5)
+        languages = {}
+        extension_index, filename_index = defaultdict(list), defaultdict(list)
+        for language in cls.languages:
+            name = language.name
+            extensions = sorted(_merge(name, 'extensions', model.metadata, 'extnames'))
+            if language.primary_extension not in extensions:
+                extensions = [language.primary_extension] + extensions
+            filenames = _merge(name, 'filenames', model.metadata, 'filenames')
+            languages[name] = (extensions, filenames)
+            for extension in extensions:
+                extension_index[extension].append(language)
+            for filename in filenames:
+                filename_index[filename].append(language)
+
+        classifier = Classifier.load(model)
+        if not classifier.candidate_indexes:
+            classifier.build_candidate_indexes(cls.candidate_sets(extension_index, filename_index))
+
+        for language in cls.languages:
+            language.extensions, language.filenames = languages[language.name]
+        cls.extension_index, cls.filename_index = extension_index, filename_index
+        Samples.use(model)
+        return model
+
+    @classmethod
+    def find_by_blob(cls, name, mode=None):
+        """
+        Internal: Look up the Languages a blob may be written in.
+
+          name - String filename
+          mode - Optional String mode (defaults to nil)
+
+        A bit of an elegant hack. If the file is executable but
+        extensionless, append a "magic" extension so it can be
+        classified with other languages that have shebang scripts.
+
+        Returns all matching Languages or [] if none were found.
+        """
+        extname = splitext(name)[1]
+        if not extname and mode and (int(mode, 8) & 05 == 05):
+            name += ".script!"
+        return cls.find_by_filename(name)
+
+    @classmethod
+    def candidate_sets(cls, extension_index=None, filename_index=None):
+        """
+        Public: Get the sets of Languages sharing an extension or a
+        filename, which the classifier has to choose from.
+
+          extension_index - Optional Hash of extension to Languages,
+                            defaults to the current one.
+          filename_index  - Optional Hash of filename to Languages,
+                            defaults to the current one.
+
+        Returns an Array of sorted Arrays of language name Strings.
+        """
+        if extension_index is None:
+            extension_index = cls.extension_index
+        if filename_index is None:
+            filename_index = cls.filename_index
+
+        sets = set()
+        for extname in set(extension_index) | set(cls.primary_extension_index):
+            langs = set(extension_index.get(extname, []))
+            lang = cls.primary_extension_index.get(extname)
+            if lang:
+                langs.add(lang)
+            sets.add(tuple(sorted([l.name for l in langs])))
+        for filename, langs in filename_index.items():
+            # Same as find_by_filename
+            extname = splitext(filename)[1]
+            langs = set(langs + extension_index.get(extname, []))
+            lang = cls.primary_extension_index.get(extname)
+            if lang:
+                langs.add(lang)
+            sets.add(tuple(sorted([l.name for l in langs])))
+        return sorted([list(names) for names in sets if len(names) > 1])
 
     def colorize(self, text, options={}):
         return highlight(text, self.lexer(), HtmlFormatter(**options))
@@ -316,23 +480,26 @@ class Language(object):
         """
         return urllib.quote(self.name, '')
 
-extensions = DATA['extnames']
-filenames = DATA['filenames']
-popular = POPULAR
-
-for name, options in sorted(LANGUAGES.iteritems(), key=lambda k: k[0]):
-    options['extensions'] = options.get('extensions', [])
-    options['filenames'] = options.get('filenames', [])
 
-    def _merge(data, item_name):
-        items = data.get(name, [])
-        for item in items:
-            if item not in options[item_name]:
-                options[item_name].append(item)
+def _merge(name, key, samples, samples_key):
+    """
+    Internal: Items of a language in languages.yml, then the ones only
+    its samples have.
 
-    _merge(extensions, 'extensions')
-    _merge(filenames, 'filenames')
+    Returns an Array of Strings.
+    """
+    items = list(LANGUAGES[name].get(key, []))
+    for item in samples.get(samples_key, {}).get(name, []):
+        if item not in items:
+            items.append(item)
+    return items
+
+metadata = Samples.metadata()
+extensions = metadata['extnames']
+filenames = metadata['filenames']
+popular = POPULAR
 
+for name, options in sorted(LANGUAGES.iteritems(), key=lambda k: k[0]):
     Language.create(dict(name=name,
                          color=options.get('color'),
                          type=options.get('type'),
@@ -343,7 +510,7 @@ for name, options in sorted(LANGUAGES.iteritems(), key=lambda k: k[0]):
                          group_name=options.get('group'),
                          searchable=options.get('searchable', True),
                          search_term=options.get('search_term'),
-                         extensions=sorted(options['extensions']),
+                         extensions=sorted(_merge(name, 'extensions', metadata, 'extnames')),
                          primary_extension=options.get('primary_extension'),
-                         filenames=options['filenames'],
+                         filenames=_merge(name, 'filenames', metadata, 'filenames'),
                          popular=name in popular))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from classifier import count_tokens
+from model import Model
+
+"""
+Vectorized backend for the language bayesian classifier.
+
+The model is held as a dense `vocabulary x languages` matrix of log
+probabilities, a batch of documents becomes a sparse matrix of token
+counts and every score of the batch comes out of one matrix product.
+
+Requires NumPy, `Classifier` is the pure Python fallback.
+"""
+
+# Upper bound of (document, token) pairs multiplied at once, keeps the
+# gathered rows of the model matrix around 16MB for 124 languages.
+CHUNK_SIZE = 16384
+
+
+class MatrixClassifier(object):
+    """ Language bayesian classifier scoring documents in batches. """
+
+    available = numpy is not None
+
+    # (md5, MatrixClassifier) of the last generated database loaded
+    _loaded = (None, None)
+
+    def __init__(self, db={}):
+        if numpy is None:
+            raise ImportError('MatrixClassifier requires numpy')
+
+        model = db if isinstance(db, Model) else Model.from_db(db)
+        self.languages = model.languages
+        self.language_index = model.language_ids
+        self.token_id = model.token_id
+        self.unseen_log_probability = model.unseen_log_probability or 0.0
+
+        # Model rows are token ids, the postings of token i fill row i
+        rows = numpy.repeat(numpy.arange(model.size), numpy.diff(model.offsets[:]))
+        columns = numpy.array(model.posting_languages[:], dtype=int)
+
+        self.log_probabilities = numpy.empty((model.size, len(model.languages)))
+        self.log_probabilities.fill(self.unseen_log_probability)
+        self.log_probabilities[rows, columns] = model.log_probabilities[:]
+
+        self.log_priors = numpy.zeros(len(model.languages))
+        if model.languages_total:
+            self.log_priors = numpy.array(model.log_priors[:], dtype=float)
+
+    def __repr__(self):
+        return '<MatrixClassifier>'
+
+    @classmethod
+    def load(cls, db):
+        """
+        Public: Get a MatrixClassifier for a database.
+
+        Same as Classifier.load, the matrix of a generated database is
+        built once and reused.  The matrix of a Model is built again
+        once its md5 changes, when a FeedbackModel takes a delta.
+
+        db - Hash classifier database object or Model.
+
+        Returns a MatrixClassifier.
+        """
+        if isinstance(db, Model):
+            key, model = (db, db.md5), db
+        else:
+            key = db.get('md5')
+            if key is None:
+                return cls(db)
+            model = Model.load(db)
+        if cls._loaded[0] is not key and cls._loaded[0] != key:
+            cls._loaded = (key, cls(model))
+        return cls._loaded[1]
+
+    def classify(self, documents, languages=[]):
+        """
+        Public: Guess the language of a batch of documents.
+
+        documents - Array of documents, each an Array of tokens or String
+                    data to analyze.
+        languages - Array of language name Strings to restrict every
+                    document to.
+
+        Examples
+
+          MatrixClassifier.load(db).classify(["def hello; end", "@end"])
+          # => [[['Ruby', -12.4], ...], [['Objective-C', -5.7], ...]]
+
+        Returns an Array with, for every document, the sorted Array of
+        result pairs Classifier.classify would return.
+        """
+        languages = list(languages or self.languages)
+        columns = [self.language_index[language] for language in languages]
+        scores = self.scores(documents, columns)
+
+        results = []
+        for document, row in zip(documents, scores):
+            if document is None:
+                results.append([])
+                continue
+            pairs = zip(languages, row.tolist())
+            results.append(sorted(pairs, key=lambda t: t[1], reverse=True))
+        return results
+
+    def scores(self, documents, columns):
+        """
+        Internal: Score documents against some languages.
+
+        documents - Array of documents, each an Array of tokens or String
+                    data, or None.
+        columns   - Array of language column Integers.
+
+        Returns a `documents x columns` Array of Float log scores.
+        """
+        token_id = self.token_id
+        indptr, indices, data = [0], [], []
+        unknown = numpy.zeros(len(documents))
+
+        for i, document in enumerate(documents):
+            for token, count in count_tokens(document or []).iteritems():
+                index = token_id(token)
+                if index is None:
+                    unknown[i] += count
+                else:
+                    indices.append(index)
+                    data.append(count)
+            indptr.append(len(indices))
+
+        # Restricting the model to the candidate columns masks out every
+        # other language before the product.
+        model = self.log_probabilities[:, columns]
+        scores = numpy.outer(unknown * self.unseen_log_probability, numpy.ones(len(columns)))
+        scores += self.log_priors[columns]
+
+        indices = numpy.array(indices, dtype=int)
+        data = numpy.array(data, dtype=float)
+        start = 0
+        while start < len(documents):
+            stop = start + 1
+            while stop < len(documents) and indptr[stop + 1] - indptr[start] <= CHUNK_SIZE:
+                stop += 1
+            scores[start:stop] += self.sparse_dot(indptr[start:stop + 1], indices, data, model)
+            start = stop
+        return scores
+
+    @staticmethod
+    def sparse_dot(indptr, indices, data, model):
+        """
+        Internal: Multiply a CSR count matrix by a dense model matrix.
+
+        indptr  - Array of row offsets into indices and data.
+        indices - numpy Array of vocabulary row Integers.
+        data    - numpy Array of Float counts.
+        model   - numpy `vocabulary x languages` Array.
+
+        Returns a `len(indptr) - 1 x languages` numpy Array.
+        """
+        begin, end = indptr[0], indptr[-1]
+        result = numpy.zeros((len(indptr) - 1, model.shape[1]))
+        if begin == end:
+            return result
+
+        products = model[indices[begin:end]] * data[begin:end, numpy.newaxis]
+        offsets = numpy.array(indptr[:-1]) - begin
+        nonempty = numpy.diff(indptr) > 0
+        # reduceat can not produce empty sums, those rows stay at zero
+        result[nonempty] = numpy.add.reduceat(products, offsets[nonempty], axis=0)
+        return result
@@ -0,0 +1,927 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import izip
+from zlib import crc32
+
+"""
+Compact classifier model.
+
+Languages and tokens are mapped to Integer ids, and all the counts live
+in flat arrays keyed by token id: for every token, the postings of the
+languages that saw it, as a language id and a count.  This is the
+layout of a sparse matrix stored by rows (CSR), and takes a fraction of
+the memory of the nested Hashes of a classifier database.
+
+A Model can be written to a binary file, which MappedModel reads through
+mmap without parsing it: lookups only touch the pages they need, and
+processes mapping the same file share it in the page cache.  The file can
+carry the candidate indexes of Classifier too, so that a pool of workers
+mapping it shares them instead of building its own.
+"""
+
+MAGIC = 'LGMD'
+VERSION = 3
+
+# Sections of a model file, in file order, with the type of their items
+SECTIONS = (('language_names', 'B'),
+            ('language_name_offsets', 'I'),
+            ('language_counts', 'I'),
+            ('language_tokens', 'I'),
+            ('log_priors', 'd'),
+            ('token_names', 'B'),
+            ('token_name_offsets', 'I'),
+            ('offsets', 'I'),
+            ('posting_languages', 'H'),
+            ('posting_counts', 'I'),
+            ('log_probabilities', 'd'),
+            ('token_gaps', 'd'),
+            ('token_slots', 'I'),
+            # Candidate indexes, set after set: the language ids of a set,
+            # then the token ids, gaps and rows of its entries, and an open
+            # addressing table of entry index + 1 by token id.
+            ('candidate_languages', 'H'),
+            ('candidate_set_offsets', 'I'),
+            ('candidate_entry_offsets', 'I'),
+            ('candidate_tokens', 'I'),
+            ('candidate_gaps', 'd'),
+            ('candidate_rows', 'd'),
+            ('candidate_slots', 'I'),
+            ('metadata', 'B'))
+
+# Default number of buckets of a HashedModel
+HASH_BUCKETS = 1 << 14
+
+# magic, version, md5, unseen log probability, number of languages,
+# tokens, postings and token slots, CRC-32 of everything past the header,
+# then the offset and length of every section.
+HEADER = struct.Struct('<4sH32sdIIIII' + 'II' * len(SECTIONS))
+
+# Bytes read at once when checking the CRC of a file
+CHECK_SIZE = 1 << 20
+
+
+def compact(token):
+    """
+    Internal: Get the smallest equivalent of a token.
+
+    Tokens are held as interned UTF-8 str, which is what the Tokenizer
+    produces from file contents, whereas JSON gives unicode.  Non-ASCII
+    tokens of samples.json thus match the ones of files, which they
+    never did when the Hash database was scored directly.
+
+    Returns a String.
+    """
+    if isinstance(token, unicode):
+        token = token.encode('utf-8')
+    return intern(token)
+
+
+def token_hash(token):
+    """
+    Internal: Hash of a token, stable across processes and platforms.
+
+    Returns an Integer.
+    """
+    return crc32(token) & 0xffffffff
+
+
+class Model(object):
+    """ Classifier database held in arrays keyed by token id. """
+
+    # (md5, Model) of the last generated database loaded
+    _loaded = (None, None)
+
+    # Whether token ids are hash buckets, see HashedModel
+    hashed = False
+
+    # Candidate indexes shipped in a model file, see MappedModel, and the
+    # md5 of the model they were built for
+    candidate_indexes = {}
+    candidate_md5 = None
+
+    # Classifier of the Model, see Classifier.load
+    classifier = None
+
+    def __init__(self, languages, language_counts, language_tokens,
+                 tokens, offsets, posting_languages, posting_counts, md5=None):
+        """
+        Public: Initialize a Model from its columns.
+
+          languages         - Array of language name Strings, by id.
+          language_counts   - Array of the number of samples per language.
+          language_tokens   - Array of the number of tokens per language.
+          tokens            - Array of token Strings, by id.
+          offsets           - Array of len(tokens) + 1 Integers, the
+                              postings of token i are at offsets[i] up to
+                              offsets[i + 1].
+          posting_languages - Array of language ids, increasing within
+                              the postings of a token.
+          posting_counts    - Array of the number of times the language
+                              saw the token.
+          md5               - Optional String digest of the database.
+
+        Returns a Model.
+        """
+        self.languages = languages
+        self.language_ids = dict([(language, i) for i, language in enumerate(languages)])
+        self.language_counts = language_counts
+        self.language_tokens = language_tokens
+        self.tokens = tokens
+        self.size = len(tokens)
+        self.vocabulary = dict([(token, i) for i, token in enumerate(tokens)])
+        self.offsets = offsets
+        self.posting_languages = posting_languages
+        self.posting_counts = posting_counts
+        self.tokens_total = sum(language_tokens)
+        self.languages_total = sum(language_counts)
+        self.md5 = md5
+        self.metadata = {}
+        self.build_tables()
+
+    def __repr__(self):
+        return '<Model languages:%d tokens:%d>' % (len(self.languages), self.size)
+
+    @classmethod
+    def from_db(cls, db):
+        """
+        Public: Build a Model from a classifier database.
+
+        db - Hash classifier database object
+
+        Returns a Model.
+        """
+        tokens = db.get('tokens', {})
+        languages = sorted(db.get('languages', {}))
+
+        vocabulary = set()
+        for language in languages:
+            vocabulary.update([compact(token) for token in tokens.get(language, {})])
+        vocabulary = sorted(vocabulary)
+        token_ids = dict([(token, i) for i, token in enumerate(vocabulary)])
+
+        # Count the postings of every token first, then fill them in
+        # language order so they are sorted by language id.
+        sizes = array('l', [0]) * len(vocabulary)
+        for language in languages:
+            for token in tokens.get(language, {}):
+                sizes[token_ids[compact(token)]] += 1
+        offsets = array('l', [0])
+        for size in sizes:
+            offsets.append(offsets[-1] + size)
+
+        cursors = array('l', offsets[:-1])
+        posting_languages = array('H', [0]) * offsets[-1]
+        posting_counts = array('l', [0]) * offsets[-1]
+        for language_id, language in enumerate(languages):
+            for token, count in tokens.get(language, {}).iteritems():
+                token_id = token_ids[compact(token)]
+                i = cursors[token_id]
+                posting_languages[i] = language_id
+                posting_counts[i] = count
+                cursors[token_id] = i + 1
+
+        language_counts = array('l', [db['languages'][language] for language in languages])
+        language_tokens = array('l', [db.get('language_tokens', {}).get(language, 0)
+                                      for language in languages])
+        model = cls([compact(language) for language in languages], language_counts,
+                    language_tokens, vocabulary, offsets, posting_languages, posting_counts,
+                    db.get('md5'))
+        for key in ('extnames', 'filenames'):
+            if key in db:
+                model.metadata[key] = db[key]
+        return model
+
+    def to_db(self):
+        """
+        Public: Rebuild the classifier database of the Model.
+
+        Gives back the database from_db was given, metadata included,
+        which is how the md5 of a model file is checked.  Raises KeyError
+        for hashed models, they don't keep their tokens.
+
+        Returns a Hash classifier database object, without md5.
+        """
+        tokens, language_tokens = {}, {}
+        for token_id in xrange(self.size):
+            language_ids, counts = self.row_counts(token_id)
+            if not len(counts):
+                continue
+            token = self.token(token_id)
+            for language_id, count in izip(language_ids, counts):
+                tokens.setdefault(self.languages[language_id], {})[token] = count
+        for language, count in izip(self.languages, self.language_tokens):
+            if count:
+                language_tokens[language] = count
+
+        db = {'tokens': tokens,
+              'language_tokens': language_tokens,
+              'languages': dict(izip(self.languages, self.language_counts)),
+              'tokens_total': self.tokens_total,
+              'languages_total': self.languages_total}
+        db.update(self.metadata)
+        return db
+
+    @classmethod
+    def load(cls, db):
+        """
+        Public: Get the Model of a database.
+
+        The Model of a generated database (one carrying an 'md5') is
+        built once and shared, other databases get a fresh Model.
+
+        db - Hash classifier database object
+
+        Returns a Model.
+        """
+        md5 = db.get('md5')
+        if md5 is None:
+            return cls.from_db(db)
+        if cls._loaded[0] != md5:
+            cls._loaded = (md5, cls.from_db(db))
+        return cls._loaded[1]
+
+    def build_tables(self):
+        """
+        Internal: Precompute the log probabilities used for scoring.
+
+        Builds log P(token | language) for every posting, the log
+        probability given to tokens a language has never seen, the log
+        prior of every language and the gap of every token: the largest
+        difference of log probability it makes between two languages.
+
+        Returns nothing.
+        """
+        self.log_probabilities = array('d')
+        self.log_priors = array('d')
+        self.token_gaps = array('d')
+        self.unseen_log_probability = None
+
+        if not self.tokens_total:
+            return
+
+        log = math.log
+        unseen = self.unseen_log_probability = log(1 / float(self.tokens_total))
+        totals = [float(total) for total in self.language_tokens]
+        self.log_probabilities = array('d', (log(count / totals[language_id])
+                                             for language_id, count in izip(self.posting_languages,
+                                                                            self.posting_counts)))
+
+        languages_total = float(self.languages_total)
+        self.log_priors = array('d', [log(count / languages_total) for count in self.language_counts])
+
+        # Languages that never saw a token give it the unseen log
+        # probability, which is lower than any seen one.
+        offsets, logps = self.offsets, self.log_probabilities
+        everywhere = len(self.languages)
+        gaps = self.token_gaps = array('d', [0.0]) * self.size
+        for token_id in xrange(self.size):
+            lo, hi = offsets[token_id], offsets[token_id + 1]
+            if lo == hi:
+                # Empty bucket of a HashedModel
+                continue
+            row = logps[lo:hi]
+            floor = min(row) if hi - lo == everywhere else unseen
+            gaps[token_id] = max(row) - floor
+
+    def token(self, token_id):
+        """
+        Public: Get a token by id.
+
+        Returns a String.
+        """
+        return self.tokens[token_id]
+
+    def token_id(self, token):
+        """
+        Public: Get the id of a token.
+
+        token - String token.
+
+        Returns an Integer, or None for unknown tokens.
+        """
+        if isinstance(token, unicode):
+            token = token.encode('utf-8')
+        return self.vocabulary.get(token)
+
+    def token_lookup(self):
+        """
+        Public: Get what Tokenizer.count_token_ids looks tokens up in.
+
+        Returns the Hash of token to id of the model.
+        """
+        return self.vocabulary
+
+    def row(self, token_id):
+        """
+        Internal: Get the postings of a token.
+
+        Slicing reads a whole row at once, which is much cheaper than
+        item by item for a MappedModel.
+
+        token_id - Integer token id.
+
+        Returns a pair of Arrays, the language ids that saw the token and
+        the matching log probabilities.
+        """
+        lo, hi = self.offsets[token_id:token_id + 2]
+        return self.posting_languages[lo:hi], self.log_probabilities[lo:hi]
+
+    def row_counts(self, token_id):
+        """
+        Internal: Get the postings of a token, with their counts.
+
+        token_id - Integer token id.
+
+        Returns a pair of Arrays, the language ids that saw the token and
+        the number of times they saw it.
+        """
+        lo, hi = self.offsets[token_id:token_id + 2]
+        return self.posting_languages[lo:hi], self.posting_counts[lo:hi]
+
+    def posting(self, token_id, language_id):
+        """
+        Internal: Find where a language's count of a token is.
+
+        token_id    - Integer token id or None.
+        language_id - Integer language id or None.
+
+        Returns the Integer posting index, or None if the language never
+        saw the token.
+        """
+        if token_id is None or language_id is None:
+            return
+        lo, hi = self.offsets[token_id:token_id + 2]
+        i = bisect_left(self.posting_languages, language_id, lo, hi)
+        if i < hi and self.posting_languages[i] == language_id:
+            return i
+
+    def count(self, token, language):
+        """
+        Public: Number of times a language saw a token.
+
+        token    - String token.
+        language - String language name.
+
+        Returns an Integer.
+        """
+        i = self.posting(self.token_id(token), self.language_ids.get(language))
+        return 0 if i is None else self.posting_counts[i]
+
+    def token_table(self):
+        """
+        Internal: Build the token lookup sections of a model file.
+
+        Returns a pair of the Array of tokens by id, and an open addressing
+        table of token id + 1 by token_hash, 0 marking empty slots.
+        """
+        slots = 1
+        while slots < 2 * self.size:
+            slots *= 2
+        token_slots = array('I', [0]) * slots
+        for token_id in xrange(self.size):
+            slot = token_hash(self.token(token_id)) & (slots - 1)
+            while token_slots[slot]:
+                slot = (slot + 1) & (slots - 1)
+            token_slots[slot] = token_id + 1
+        return [self.token(token_id) for token_id in xrange(self.size)], token_slots
+
+    def candidate_tables(self, candidate_indexes):
+        """
+        Internal: Build the candidate index sections of a model file.
+
+        Sets with a language missing from the model are left out, they
+        can't be scored.
+
+        candidate_indexes - Hash of the candidate indexes of a Classifier,
+                            see Classifier.build_candidate_indexes.
+
+        Returns a Hash of section name to Array.
+        """
+        tables = dict([(name, array(typecode)) for name, typecode in SECTIONS
+                       if name.startswith('candidate_')])
+        tables['candidate_set_offsets'].append(0)
+        tables['candidate_entry_offsets'].append(0)
+        for languages, index in sorted(candidate_indexes.values()):
+            if [language for language in languages if language not in self.language_ids]:
+                continue
+            token_ids = sorted(index)
+            slots = 1
+            while slots < 2 * len(token_ids):
+                slots *= 2
+            entry_slots = array('I', [0]) * slots
+            for i, token_id in enumerate(token_ids):
+                gap, row = index[token_id]
+                tables['candidate_tokens'].append(token_id)
+                tables['candidate_gaps'].append(gap)
+                tables['candidate_rows'].extend(row)
+                slot = token_id & (slots - 1)
+                while entry_slots[slot]:
+                    slot = (slot + 1) & (slots - 1)
+                entry_slots[slot] = i + 1
+            tables['candidate_slots'].extend(entry_slots)
+            tables['candidate_languages'].extend([self.language_ids[language] for language in languages])
+            tables['candidate_set_offsets'].append(len(tables['candidate_languages']))
+            tables['candidate_entry_offsets'].append(len(tables['candidate_tokens']))
+        return tables
+
+    def dump(self, path, candidate_indexes={}):
+        """
+        Public: Write the Model to a binary file MappedModel can open.
+
+        The file holds a header, then every section of SECTIONS, 8 bytes
+        aligned: language names, per language counts, the sorted
+        vocabulary, fixed-width posting tables, an open addressing table
+        of token ids by token_hash and the candidate indexes.
+
+        path              - String path of the file.
+        candidate_indexes - Optional Hash of the candidate indexes of a
+                            Classifier of this Model, to ship with it.
+
+        Returns nothing.
+        """
+        tokens, token_slots = self.token_table()
+
+        def strings(values):
+            offsets = array('I', [0])
+            for value in values:
+                offsets.append(offsets[-1] + len(value))
+            return ''.join(values), offsets
+
+        language_names, language_name_offsets = strings(self.languages)
+        token_names, token_name_offsets = strings(tokens)
+        columns = {'language_names': language_names,
+                   'language_name_offsets': language_name_offsets,
+                   'language_counts': self.language_counts,
+                   'language_tokens': self.language_tokens,
+                   'log_priors': self.log_priors,
+                   'token_names': token_names,
+                   'token_name_offsets': token_name_offsets,
+                   'offsets': self.offsets,
+                   'posting_languages': self.posting_languages,
+                   'posting_counts': self.posting_counts,
+                   'log_probabilities': self.log_probabilities,
+                   'token_gaps': self.token_gaps,
+                   'token_slots': token_slots,
+                   'metadata': json.dumps(self.metadata, sort_keys=True)}
+        columns.update(self.candidate_tables(candidate_indexes))
+
+        blobs, positions = [], []
+        position = HEADER.size
+        crc = 0
+        for name, typecode in SECTIONS:
+            values = columns[name]
+            if typecode == 'B':
+                blob = values
+            else:
+                blob = struct.pack('<%d%s' % (len(values), typecode), *values)
+            padding = '\0' * (-position % 8)
+            position += len(padding)
+            positions.extend([position, len(values)])
+            blobs.extend([padding, blob])
+            crc = crc32(blob, crc32(padding, crc))
+            position += len(blob)
+
+        header = HEADER.pack(MAGIC, VERSION, str(self.md5 or ''), self.unseen_log_probability or 0.0,
+                             len(self.languages), self.size, len(self.posting_counts), len(token_slots),
+                             crc & 0xffffffff, *positions)
+        f = open(path, 'wb')
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+        f.close()
+
+
+class HashedModel(Model):
+    """
+    Model of token hashes instead of tokens.
+
+    Tokens are hashed into a fixed number of buckets, and a bucket stands
+    for all of its tokens: the model is bounded by buckets x languages
+    postings however many tokens the samples have, and needs no
+    vocabulary.  Colliding tokens share their counts, which costs a bit
+    of accuracy.
+    """
+
+    hashed = True
+
+    def __init__(self, languages, language_counts, language_tokens,
+                 buckets, offsets, posting_languages, posting_counts, md5=None):
+        """
+        Public: Initialize a HashedModel from its columns.
+
+        Takes the columns of Model, with the Integer number of buckets,
+        a power of 2, instead of the Array of tokens: offsets are by
+        bucket.
+
+        Returns a HashedModel.
+        """
+        self.languages = languages
+        self.language_ids = dict([(language, i) for i, language in enumerate(languages)])
+        self.language_counts = language_counts
+        self.language_tokens = language_tokens
+        self.size = buckets
+        self.offsets = offsets
+        self.posting_languages = posting_languages
+        self.posting_counts = posting_counts
+        self.tokens_total = sum(language_tokens)
+        self.languages_total = sum(language_counts)
+        self.md5 = md5
+        self.metadata = {}
+        self.build_tables()
+
+    def __repr__(self):
+        return '<HashedModel languages:%d buckets:%d>' % (len(self.languages), self.size)
+
+    @classmethod
+    def from_db(cls, db, buckets=HASH_BUCKETS):
+        """
+        Public: Build a HashedModel from a classifier database.
+
+        db      - Hash classifier database object
+        buckets - Integer number of buckets, a power of 2.
+
+        Returns a HashedModel.
+        """
+        if buckets & (buckets - 1):
+            raise ValueError('buckets must be a power of 2')
+        tokens = db.get('tokens', {})
+        languages = sorted(db.get('languages', {}))
+
+        rows = {}
+        for language_id, language in enumerate(languages):
+            for token, count in tokens.get(language, {}).iteritems():
+                row = rows.setdefault(token_hash(compact(token)) & (buckets - 1), {})
+                row[language_id] = row.get(language_id, 0) + count
+
+        offsets = array('l', [0])
+        posting_languages, posting_counts = array('H'), array('l')
+        for bucket in xrange(buckets):
+            row = rows.get(bucket, {})
+            for language_id in sorted(row):
+                posting_languages.append(language_id)
+                posting_counts.append(row[language_id])
+            offsets.append(len(posting_counts))
+
+        language_counts = array('l', [db['languages'][language] for language in languages])
+        language_tokens = array('l', [db.get('language_tokens', {}).get(language, 0)
+                                      for language in languages])
+        model = cls([compact(language) for language in languages], language_counts,
+                    language_tokens, buckets, offsets, posting_languages, posting_counts,
+                    db.get('md5'))
+        for key in ('extnames', 'filenames'):
+            if key in db:
+                model.metadata[key] = db[key]
+        return model
+
+    def token(self, token_id):
+        """
+        Public: Tokens aren't kept, a bucket has no single token.
+
+        Raises KeyError.
+        """
+        raise KeyError('a HashedModel has no tokens')
+
+    def token_id(self, token):
+        """
+        Public: Get the bucket of a token.
+
+        token - String token.
+
+        Returns an Integer.
+        """
+        if isinstance(token, unicode):
+            token = token.encode('utf-8')
+        return token_hash(token) & (self.size - 1)
+
+    def token_lookup(self):
+        """
+        Public: Get what Tokenizer.count_token_ids looks tokens up in.
+
+        Returns the token_id function, buckets are found by hashing.
+        """
+        return self.token_id
+
+    def token_table(self):
+        """
+        Internal: Buckets are found by hashing, the file has no tokens.
+
+        Returns a pair of empty Arrays.
+        """
+        return [], array('I')
+
+
+class Column(object):
+    """ Read-only array of fixed-width numbers held in a buffer. """
+
+    def __init__(self, buffer, offset, typecode, length):
+        self.buffer = buffer
+        self.offset = offset
+        self.typecode = typecode
+        self.length = length
+        item = struct.Struct('<' + typecode)
+        self.unpack = item.unpack_from
+        self.width = item.size
+
+    def __repr__(self):
+        return '<Column %s x %d>' % (self.typecode, self.length)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def copy(self):
+        """
+        Public: Copy the column into memory.
+
+        Returns an Array.
+        """
+        copy = array(self.typecode)
+        if copy.itemsize == self.width and sys.byteorder == 'little':
+            copy.fromstring(self.buffer[self.offset:self.offset + self.length * self.width])
+        else:
+            copy.extend(self[:])
+        return copy
+
+    def __getitem__(self, i):
+        if i.__class__ is int and 0 <= i < self.length:
+            return self.unpack(self.buffer, self.offset + i * self.width)[0]
+        if i.__class__ is not slice:
+            if i < 0:
+                i += self.length
+            if not 0 <= i < self.length:
+                raise IndexError('column index out of range')
+            return self.unpack(self.buffer, self.offset + i * self.width)[0]
+        start, stop, step = i.indices(self.length)
+        if step != 1:
+            return [self[j] for j in xrange(start, stop, step)]
+        return struct.unpack_from('<%d%s' % (max(stop - start, 0), self.typecode),
+                                  self.buffer, self.offset + start * self.width)
+
+
+class MappedModel(Model):
+    """ Model reading the tables of a model file in place. """
+
+    def __init__(self, buffer, copy=True):
+        """
+        Public: Initialize a MappedModel over the contents of a model file.
+
+        buffer - mmap or String holding a file written by Model.dump.
+        copy   - Whether to copy the token lookup tables into memory, which
+                 makes lookups faster.  Without the copy, nothing of the
+                 model is held by the process but its languages: processes
+                 mapping the same file share all of it.
+
+        Raises ValueError when buffer isn't a whole model file.
+
+        Returns a MappedModel.
+        """
+        if len(buffer) < HEADER.size:
+            raise ValueError('not a linguist model file')
+        fields = HEADER.unpack_from(buffer, 0)
+        magic, version, md5, unseen, n_languages, n_tokens, n_postings, n_slots, crc = fields[:9]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a linguist model file')
+
+        sections = {}
+        for i, (name, typecode) in enumerate(SECTIONS):
+            offset, length = fields[9 + 2 * i], fields[10 + 2 * i]
+            # Nothing is read past the end of a truncated file
+            if offset + length * struct.calcsize('<' + typecode) > len(buffer):
+                raise ValueError('truncated model file, %s runs past its end' % name)
+            if typecode == 'B':
+                sections[name] = (offset, length)
+            else:
+                sections[name] = Column(buffer, offset, typecode, length)
+
+        self.buffer = buffer
+        self.crc = crc
+        self.md5 = md5.rstrip('\0') or None
+        self.size = n_tokens
+
+        # Languages are few, they are read once
+        offset = sections['language_names'][0]
+        bounds = sections['language_name_offsets'][:]
+        self.languages = [intern(buffer[offset + bounds[i]:offset + bounds[i + 1]])
+                          for i in xrange(n_languages)]
+        self.language_ids = dict([(language, i) for i, language in enumerate(self.languages)])
+        self.language_counts = sections['language_counts'][:]
+        self.language_tokens = sections['language_tokens'][:]
+        self.log_priors = sections['log_priors'][:]
+        self.tokens_total = sum(self.language_tokens)
+        self.languages_total = sum(self.language_counts)
+        self.unseen_log_probability = unseen if self.tokens_total else None
+
+        self.token_names = sections['token_names'][0]
+        # Every lookup goes through these tables, they are copied out of
+        # the file as they are, which is cheaper than reading them item by
+        # item.  Postings stay in the file.
+        self.token_name_offsets = sections['token_name_offsets']
+        self.offsets = sections['offsets']
+        self.token_slots = sections['token_slots']
+        if copy:
+            self.token_name_offsets = self.token_name_offsets.copy()
+            self.offsets = self.offsets.copy()
+            self.token_slots = self.token_slots.copy()
+        self.posting_languages = sections['posting_languages']
+        self.posting_counts = sections['posting_counts']
+        self.log_probabilities = sections['log_probabilities']
+        self.token_gaps = sections['token_gaps']
+        self.slot_mask = n_slots - 1
+        # Files of a HashedModel have no token table, ids are buckets
+        self.hashed = not n_slots
+
+        set_offsets = sections['candidate_set_offsets'][:]
+        entry_offsets = sections['candidate_entry_offsets'][:]
+        language_ids = sections['candidate_languages'][:]
+        self.candidate_indexes = {}
+        row_offset = slot_offset = 0
+        for i in xrange(len(set_offsets) - 1):
+            languages = tuple([self.languages[language_id]
+                               for language_id in language_ids[set_offsets[i]:set_offsets[i + 1]]])
+            index = CandidateIndex(sections, languages, entry_offsets[i], entry_offsets[i + 1],
+                                   row_offset, slot_offset)
+            self.candidate_indexes[frozenset(languages)] = (languages, index)
+            row_offset += len(index) * len(languages)
+            slot_offset += index.slots
+        self.candidate_md5 = self.md5
+
+        offset, length = sections['metadata']
+        self.metadata = json.loads(buffer[offset:offset + length]) if length else {}
+
+    def __repr__(self):
+        return '<MappedModel languages:%d %s:%d>' % (len(self.languages),
+                                                     'buckets' if self.hashed else 'tokens',
+                                                     self.size)
+
+    @classmethod
+    def open(cls, path, copy=True):
+        """
+        Public: Map a model file.
+
+        path - String path of a file written by Model.dump.
+        copy - Whether to copy the token lookup tables into memory.
+
+        Raises ValueError when path isn't a whole model file.
+
+        Returns a MappedModel.
+        """
+        f = open(path, 'rb')
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        return cls(buffer, copy)
+
+    def verify(self):
+        """
+        Public: Check the contents of the file against the CRC-32 of its
+        header, which catches a file corrupted or overwritten in place.
+
+        The whole file is read, a chunk at a time.
+
+        Returns a Boolean.
+        """
+        buffer, crc = self.buffer, 0
+        for start in xrange(HEADER.size, len(buffer), CHECK_SIZE):
+            crc = crc32(buffer[start:start + CHECK_SIZE], crc)
+        return crc & 0xffffffff == self.crc
+
+    @staticmethod
+    def read_metadata(path):
+        """
+        Public: Read the metadata of a model file, and nothing else.
+
+        path - String path of a file written by Model.dump.
+
+        Raises ValueError when path isn't a whole model file.
+
+        Returns a Hash.
+        """
+        f = open(path, 'rb')
+        try:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError('not a linguist model file')
+            fields = HEADER.unpack(header)
+            if fields[:2] != (MAGIC, VERSION):
+                raise ValueError('not a linguist model file')
+            offset, length = fields[-2:]
+            f.seek(offset)
+            metadata = f.read(length)
+            if len(metadata) < length:
+                raise ValueError('truncated model file, metadata runs past its end')
+            return json.loads(metadata) if length else {}
+        finally:
+            f.close()
+
+    def token(self, token_id):
+        """
+        Public: Get a token by id.
+
+        Returns a String, raises KeyError for hashed models.
+        """
+        if self.hashed:
+            raise KeyError('a HashedModel has no tokens')
+        offset = self.token_names
+        lo, hi = self.token_name_offsets[token_id:token_id + 2]
+        return self.buffer[offset + lo:offset + hi]
+
+    def token_id(self, token):
+        """
+        Public: Get the id of a token.
+
+        token - String token.
+
+        Returns an Integer, or None for unknown tokens.
+        """
+        if isinstance(token, unicode):
+            token = token.encode('utf-8')
+        if self.hashed:
+            return token_hash(token) & (self.size - 1)
+        mask, slots = self.slot_mask, self.token_slots
+        slot = token_hash(token) & mask
+        while True:
+            entry = slots[slot]
+            if not entry:
+                return
+            if self.token(entry - 1) == token:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def token_lookup(self):
+        """
+        Public: Get what Tokenizer.count_token_ids looks tokens up in.
+
+        The tokens stay in the file, they aren't loaded into a Hash.
+
+        Returns the token_id function.
+        """
+        return self.token_id
+
+
+class CandidateIndex(object):
+    """
+    Candidate index of a set of languages, read in place from a model file.
+
+    Looks like the Hash of token id to (gap, row) of
+    Classifier.build_candidate_indexes, for classify_top.  Items are
+    unpacked straight from the buffer, a lookup costs a couple of unpacks.
+    """
+
+    def __init__(self, sections, languages, lo, hi, row_offset, slot_offset):
+        self.size = len(languages)
+        self.lo = lo
+        self.length = hi - lo
+        self.slots = 1
+        while self.slots < 2 * self.length:
+            self.slots *= 2
+        tokens, gaps = sections['candidate_tokens'], sections['candidate_gaps']
+        rows, slots = sections['candidate_rows'], sections['candidate_slots']
+        self.buffer = tokens.buffer
+        self.tokens = tokens.offset + lo * tokens.width
+        self.gaps = gaps.offset + lo * gaps.width
+        self.rows = rows.offset + row_offset * rows.width
+        self.entry_slots = slots.offset + slot_offset * slots.width
+        self.unpack_id = tokens.unpack
+        self.unpack_gap = gaps.unpack
+        self.unpack_row = struct.Struct('<%dd' % self.size).unpack_from
+        self.row_width = self.size * rows.width
+
+    def __repr__(self):
+        return '<CandidateIndex languages:%d tokens:%d>' % (self.size, self.length)
+
+    def __len__(self):
+        return self.length
+
+    def get(self, token_id, default=None):
+        """
+        Public: Get the entry of a token.
+
+        token_id - Integer token id or None.
+        default  - Value returned for tokens missing from the index.
+
+        Returns a pair of the Float gap of the token and the Array of its
+        log probabilities by candidate position, or default.
+        """
+        if token_id is None or not self.length:
+            return default
+        buffer, unpack = self.buffer, self.unpack_id
+        mask = self.slots - 1
+        slot = token_id & mask
+        while True:
+            entry = unpack(buffer, self.entry_slots + 4 * slot)[0]
+            if not entry:
+                return default
+            entry -= 1
+            if unpack(buffer, self.tokens + 4 * entry)[0] == token_id:
+                return (self.unpack_gap(buffer, self.gaps + 8 * entry)[0],
+                        self.unpack_row(buffer, self.rows + entry * self.row_width))
+            slot = (slot + 1) & mask
@@ -8,6 +8,11 @@ from itertools import imap
 from file_blob import FileBlob
 from language import Language
 
+# Number of blobs whose languages are detected together, and bound of
+# their bytes: blobs keep the data they read until then
+BATCH_SIZE = 256
+BATCH_BYTES = 1 << 22
+
 
 class Repository(object):
     """
@@ -104,6 +109,7 @@ class Repository(object):
         if self.computed_stats:
             return
 
+        batch, batch_bytes = [], 0
         for blob in self.enum:
             # Skip vendored
             if blob.is_vendored:
@@ -112,11 +118,14 @@ class Repository(object):
             if blob.is_likely_binary:
                 continue
             # Skip generated blobs
-            if blob.is_generated or blob.language is None:
+            if blob.is_generated:
                 continue
-            # Only include programming languages and acceptable markup languages
-            if blob.language.type == 'programming' or blob.language.name in Language.detectable_markup():
-                self.sizes[blob.language.group] += blob.size
+            batch.append(blob)
+            batch_bytes += blob.size
+            if len(batch) >= BATCH_SIZE or batch_bytes >= BATCH_BYTES:
+                self.add_blobs(batch)
+                batch, batch_bytes = [], 0
+        self.add_blobs(batch)
 
         # Compute total size
         self._size = sum(self.sizes.itervalues())
@@ -127,3 +136,25 @@ class Repository(object):
             self._language = primary[0][0]
 
         self.computed_stats = True
+
+    def add_blobs(self, blobs):
+        """
+        Internal: Detect the Languages of blobs in one batch and add them
+        to the language breakdown.
+
+        blobs - Array of Blob objects
+
+        Returns nothing
+        """
+        pending = [blob for blob in blobs if not hasattr(blob, '_language')]
+        languages = Language.detect_many([(blob.name, blob.language_data, blob.mode)
+                                          for blob in pending])
+        for blob, language in zip(pending, languages):
+            blob._language = language
+
+        for blob in blobs:
+            if blob.language is None:
+                continue
+            # Only include programming languages and acceptable markup languages
+            if blob.language.type == 'programming' or blob.language.name in Language.detectable_markup():
+                self.sizes[blob.language.group] += blob.size
@@ -1,19 +1,65 @@
 # -*- coding: utf-8 -*-
 import json
-from os import listdir
+from os import getpid, listdir, rename
 from os.path import realpath, dirname, exists, join, splitext
-from collections import defaultdict
+from collections import defaultdict, Mapping
+from multiprocessing import Pool
 
 from classifier import Classifier
+from feedback import FeedbackModel
 from md5 import MD5
+from model import Model, HashedModel, MappedModel
 
 DIR = dirname(realpath(__file__))
 ROOT = join(dirname(dirname(DIR)), "samples")
 PATH = join(DIR, "samples.json")
-DATA = {}
+MODEL_PATH = join(DIR, "samples.model")
 
-if exists(PATH):
-    DATA = json.load(open(PATH))
+
+class Database(Mapping):
+    """
+    Classifier database, read from samples.json on first access.
+
+    It is a read-only Mapping rather than a Hash, so that code reading
+    Hashes by their internals can't see it empty: dict(DATA) loads it,
+    while json and MD5 refuse it.  Use load for the Hash itself.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    loaded = property(lambda self: self._db is not None)
+
+    def load(self):
+        """
+        Public: Read the database, once.
+
+        Returns the Hash.
+        """
+        if self._db is None:
+            db = {}
+            if exists(self.path):
+                db = json.load(open(self.path))
+            self._db = db
+        return self._db
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __contains__(self, key):
+        return key in self.load()
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def __repr__(self):
+        return repr(self.load())
+
+DATA = Database(PATH)
 
 
 class Samples(object):
@@ -21,13 +67,207 @@ class Samples(object):
     Model for accessing classifier training data.
     """
 
+    # The classifier model of the samples, once loaded
+    _model = None
+
     def __repr__(self):
         return '<Samples>'
 
     @classmethod
-    def generate(cls):
-        data = cls.data()
+    def model(cls):
+        """
+        Public: Get the classifier model of the samples.
+
+        Maps samples.model on first call, or builds the model of DATA
+        when it wasn't generated.
+
+        Returns a Model.
+        """
+        if cls._model is None:
+            if exists(MODEL_PATH):
+                cls._model = MappedModel.open(MODEL_PATH)
+            else:
+                cls._model = Model.load(DATA)
+        return cls._model
+
+    @classmethod
+    def feedback(cls, path=None):
+        """
+        Public: Open the model of the samples to train and untrain deltas.
+
+        Wraps the model in a FeedbackModel on first call, detection goes
+        through it from then on.
+
+        path - Optional String path of the delta log, see FeedbackModel.
+
+        Examples
+
+          Samples.feedback('/var/lib/linguist/deltas.log').train('Prolog', data)
+
+        Returns a FeedbackModel.
+        """
+        model = cls.model()
+        if not isinstance(model, FeedbackModel):
+            model = cls._model = FeedbackModel(model, path)
+        return model
+
+    @classmethod
+    def publish(cls, path, candidate_sets=()):
+        """
+        Public: Write the model of the samples for workers to attach to.
+
+        The model, with the deltas of feedback built in, is written with
+        the candidate indexes of the sets, then moved to path at once:
+        workers attached to the previous file keep it until they attach
+        again.  Put it on a tmpfs like /dev/shm to keep it in memory.
+
+        path           - String path of the file.
+        candidate_sets - Array of Arrays of language name Strings, like
+                         Language.candidate_sets() gives.
+
+        Examples
+
+          Samples.publish('/dev/shm/linguist.model', Language.candidate_sets())
+
+        Returns nothing.
+        """
+        model = cls.model()
+        if isinstance(model, FeedbackModel) and model.deltas:
+            # The file gets the md5 of its database, which open checks,
+            # rather than the digest of the deltas
+            model = model.freeze()
+            if not model.hashed:
+                model.md5 = cls.digest(model)
+        classifier = Classifier(model)
+        # Only the sets asked for are written, not the ones shipped
+        classifier.candidate_indexes = {}
+        classifier.build_candidate_indexes(candidate_sets)
+        partial = '%s.%d' % (path, getpid())
+        model.dump(partial, classifier.candidate_indexes)
+        rename(partial, path)
+
+    @classmethod
+    def attach(cls, path):
+        """
+        Public: Use a published model as the model of the samples.
+
+        The model is mapped read-only and nothing of it is copied: every
+        process attached to the same file shares its memory, candidate
+        indexes included.
+
+        path - String path of a file written by publish.
+
+        Returns the MappedModel.
+        """
+        return cls.use(MappedModel.open(path, copy=False))
+
+    @classmethod
+    def open(cls, path, md5=None):
+        """
+        Public: Open a model file and check it, without using it yet.
+
+        The contents of the file are checked against the CRC-32 of its
+        header (see MappedModel.verify), then the database of the model
+        is rebuilt and its md5 compared with the one the file carries,
+        which takes a fraction of a second.  Files of hashed models don't
+        keep their tokens, the CRC and the expected md5 are checked for
+        them.
+
+        path - String path of a file written by generate or publish.
+        md5  - Optional String md5 the model must have.
+
+        Raises ValueError when the file isn't a model file, isn't the
+        expected model or doesn't match its md5.
+
+        Returns a MappedModel.
+        """
+        model = MappedModel.open(path)
+        if not model.verify():
+            raise ValueError("%s doesn't match its CRC" % path)
+        if md5 is not None and model.md5 != md5:
+            raise ValueError('%s holds model %s, not %s' % (path, model.md5, md5))
+        if not model.hashed and cls.digest(model) != model.md5:
+            raise ValueError("%s doesn't match its md5 %s" % (path, model.md5))
+        return model
+
+    @classmethod
+    def use(cls, model):
+        """
+        Public: Make a model the model of the samples.
+
+        The swap is a single assignment: calls in flight keep the model
+        they started with.
+
+        model - Model, like open gives.
+
+        Returns the Model.
+        """
+        cls._model = model
+        return model
+
+    @classmethod
+    def digest(cls, model):
+        """
+        Public: md5 of the database of a Model, the way data computes it.
+
+        model - Model, not hashed.
+
+        Returns a String.
+        """
+        db = _encode(model.to_db())
+        for key in ('extnames', 'filenames'):
+            db[key] = defaultdict(list, db.get(key, {}))
+        return MD5.hexdigest(db)
+
+    @classmethod
+    def metadata(cls):
+        """
+        Public: Get the extensions and filenames of the samples.
+
+        They are read without the token tables.
+
+        Returns a Hash with 'extnames' and 'filenames' Hashes of language
+        name to Array of Strings.
+        """
+        if exists(MODEL_PATH):
+            metadata = MappedModel.read_metadata(MODEL_PATH)
+        else:
+            metadata = DATA
+        return {'extnames': metadata.get('extnames', {}),
+                'filenames': metadata.get('filenames', {})}
+
+    @classmethod
+    def generate(cls, buckets=None, processes=1, candidate_sets=()):
+        """
+        Public: Write the classifier database of all samples.
+
+        Writes samples.json, and samples.model for MappedModel with the
+        candidate indexes of the sets, so that detection doesn't have to
+        build them.
+
+        buckets        - Optional Integer number of buckets, a power of 2,
+                         to write a HashedModel to samples.model instead
+                         of the exact Model.
+        processes      - Integer number of processes to train with, see
+                         data.
+        candidate_sets - Array of Arrays of language name Strings, like
+                         Language.candidate_sets() gives.
+
+        Examples
+
+          Samples.generate(candidate_sets=Language.candidate_sets())
+
+        Returns nothing.
+        """
+        data = cls.data(processes)
         json.dump(data, open(PATH, 'w'), indent=2)
+        if buckets:
+            model = HashedModel.from_db(data, buckets)
+        else:
+            model = Model.from_db(data)
+        classifier = Classifier(model)
+        classifier.build_candidate_indexes(candidate_sets)
+        model.dump(MODEL_PATH, classifier.candidate_indexes)
 
     @classmethod
     def each(cls, func):
@@ -52,16 +292,49 @@ class Samples(object):
                           'extname': _extname})
 
     @classmethod
-    def data(cls):
+    def data(cls, processes=1):
         """
         Public: Build Classifier from all samples.
 
+        processes - Integer number of processes to train with.  Samples
+                    are then split by language, trained in a process pool
+                    and the partial databases merged, which gives the
+                    same database as training serially.
+
         Returns trained Classifier.
         """
+        samples = []
+        cls.each(samples.append)
+
+        if processes > 1:
+            shards = {}
+            for sample in samples:
+                shards.setdefault(sample['language'], []).append(sample)
+            pool = Pool(processes)
+            try:
+                partials = pool.map(_train, [shards[language] for language in sorted(shards)])
+            finally:
+                pool.close()
+                pool.join()
+            return cls.merge(partials)
+
+        db = cls.train(samples)
+        db['md5'] = MD5.hexdigest(db)
+        return db
+
+    @classmethod
+    def train(cls, samples):
+        """
+        Public: Train a database on some samples.
+
+        samples - Array of samples, like the ones each yields.
+
+        Returns a Hash classifier database, without md5.
+        """
         db = {'extnames': defaultdict(list),
               'filenames': defaultdict(list)}
 
-        def _learn(sample):
+        for sample in samples:
             _extname = sample.get('extname')
             _filename = sample.get('filename')
             _langname = sample['language']
@@ -77,8 +350,62 @@ class Samples(object):
 
             data = open(sample['path']).read()
             Classifier.train(db, _langname, data)
+        return db
+
+    @classmethod
+    def merge(cls, partials):
+        """
+        Public: Merge databases trained on parts of the samples.
+
+        Counts are added up and names sorted, so the result doesn't
+        depend on how the samples were split or on the order of the
+        partial databases: its md5 is the one of a database trained on
+        all of their samples at once.  Partial databases can come from
+        other processes or machines, through JSON.
+
+        partials - Array of Hash databases from train or data.
+
+        Returns a Hash classifier database, with its md5.
+        """
+        db = {'extnames': defaultdict(list),
+              'filenames': defaultdict(list)}
 
-        cls.each(_learn)
+        for partial in partials:
+            partial = _encode(partial)
+            Classifier.merge(db, partial)
+            for _langname, _extnames in partial.get('extnames', {}).iteritems():
+                for _extname in _extnames:
+                    if _extname not in db['extnames'][_langname]:
+                        db['extnames'][_langname].append(_extname)
+                db['extnames'][_langname].sort()
+            for _langname, _filenames in partial.get('filenames', {}).iteritems():
+                db['filenames'][_langname].extend(_filenames)
+                db['filenames'][_langname].sort()
 
         db['md5'] = MD5.hexdigest(db)
         return db
+
+
+def _encode(value):
+    """
+    Internal: Turn the unicode Strings of a database read from JSON back
+    into the UTF-8 Strings training gives.
+
+    Returns the value with its Strings encoded.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, dict):
+        return dict([(_encode(key), _encode(item)) for key, item in value.iteritems()])
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _train(samples):
+    """
+    Internal: Train a partial database in a worker process.
+
+    Returns a Hash classifier database.
+    """
+    return Samples.train(samples)
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
+import sys
+from mmap import mmap
 from re import compile, escape
 
-from scanner import StringScanner, StringRegexp
+is_py27 = sys.version_info >= (2, 7)
 
 """
 Generic programming language tokenizer.
@@ -14,6 +16,18 @@ language symbols.
 # Read up to 100KB
 BYTE_LIMIT = 100000
 
+# Streams are read past BYTE_LIMIT by up to 4KB, so the tokens running
+# across the limit come out whole
+READ_AHEAD = 4096
+
+# Size of the reads from file objects
+READ_SIZE = 16384
+
+# Types of the data the tokenizer scans, rather than Arrays of tokens
+DATA_TYPES = (basestring, buffer, bytearray, mmap)
+if is_py27:
+    DATA_TYPES += (memoryview,)
+
 # Start state on token, ignore anything till the next newline
 SINGLE_LINE_COMMENTS = [
     '//',  # C
@@ -32,36 +46,109 @@ MULTI_LINE_COMMENTS = [
     [r"'''", r"'''"],   # Python
 ]
 
-MULTI_LINE_COMMENT_DICT = dict([(s, StringRegexp(escape(e)))
-                                for s, e in MULTI_LINE_COMMENTS])
-
-START_SINGLE_LINE_COMMENT = StringRegexp('|'.join(map(lambda c: '\s*%s ' % escape(c), SINGLE_LINE_COMMENTS)))
-START_MULTI_LINE_COMMENT = StringRegexp('|'.join(map(lambda c: escape(c[0]), MULTI_LINE_COMMENTS)))
-
-
-REGEX_SHEBANG = StringRegexp(r'^#!.+')
-REGEX_BOL = StringRegexp(r'\n|\Z')
-REGEX_DOUBLE_QUOTE = StringRegexp(r'"')
-REGEX_SINGLE_QUOTE = StringRegexp(r"'")
-REGEX_DOUBLE_END_QUOTE = StringRegexp(r'[^\\]"')
-REGEX_SINGLE_END_QUOTE = StringRegexp(r"[^\\]'")
-REGEX_NUMBER_LITERALS = StringRegexp(r'(0x)?\d(\d|\.)*')
-REGEX_SGML = StringRegexp(r'<[^\s<>][^<>]*>')
-REGEX_COMMON_PUNCTUATION = StringRegexp(r';|\{|\}|\(|\)|\[|\]')
-REGEX_REGULAR_TOKEN = StringRegexp(r'[\w\.@#\/\*]+')
-REGEX_COMMON_OPERATORS = StringRegexp(r'<<?|\+|\-|\*|\/|%|&&?|\|\|?')
-REGEX_EMIT_START_TOKEN = StringRegexp(r'<\/?[^\s>]+')
-REGEX_EMIT_TRAILING = StringRegexp(r'\w+=')
-REGEX_EMIT_WORD = StringRegexp(r'\w+')
-REGEX_EMIT_END_TAG = StringRegexp('>')
-
-REGEX_SHEBANG_FULL = StringRegexp(r'^#!\s*\S+')
-REGEX_SHEBANG_WHITESPACE = StringRegexp(r'\s+')
-REGEX_SHEBANG_NON_WHITESPACE = StringRegexp(r'\S+')
+# Closing token of every opening token of a multiline comment
+MULTI_LINE_COMMENT_DICT = dict(MULTI_LINE_COMMENTS)
+
+START_SINGLE_LINE_COMMENT = '|'.join(map(lambda c: r'\s*%s ' % escape(c), SINGLE_LINE_COMMENTS))
+START_MULTI_LINE_COMMENT = '|'.join(map(lambda c: escape(c[0]), MULTI_LINE_COMMENTS))
+
+# Characters no step of the tokenizer starts with, skipped in one go.
+# Newlines aren't, single line comments start right after them.
+REGEX_IGNORED = r'[^\w\n#/<{("\';})\[\].@*+\-%&|]+'
+
+# Every step of the tokenizer, in the order they are tried.  Named
+# groups tell the steps with more to do apart, the others only skip
+# what they matched.
+REGEX_STEP = compile('|'.join([
+    r'(?P<shebang>#!.+)',
+    r'(?<![^\n])(?P<single_line_comment>%s)' % START_SINGLE_LINE_COMMENT,
+    r'(?P<multi_line_comment>%s)' % START_MULTI_LINE_COMMENT,
+    # Empty strings, then the opening quote of the others
+    r'""|\'\'',
+    r'(?P<quote>["\'])',
+    # Number literals
+    r'(?:0x)?\d[\d.]*(?:%s)?' % REGEX_IGNORED,
+    # SGML style brackets
+    r'(?P<sgml><[^\s<>][^<>]*>)',
+    # Common programming punctuation, regular tokens and common
+    # operators, then what is skipped after them
+    r'(?P<token>[;{}()\[\]]|[\w.@#/*]+|<<?|[+\-*/%%]|&&?|\|\|?)(?:%s)?' % REGEX_IGNORED,
+    REGEX_IGNORED,
+    r'\n',
+]))
+
+REGEX_EMIT_START_TOKEN = compile(r'<\/?[^\s>]+')
+REGEX_EMIT_TRAILING = compile(r'\w+=')
+REGEX_EMIT_WORD = compile(r'\w+')
+
+REGEX_SHEBANG_FULL = compile(r'#!\s*\S+')
+REGEX_SHEBANG_WHITESPACE = compile(r'\s+')
+REGEX_SHEBANG_NON_WHITESPACE = compile(r'\S+')
+REGEX_SHEBANG_SCRIPT = compile(r'[^\d]+')
+
+
+def scannable(data):
+    """
+    Internal: Get data in a form the tokenizer scans in place.
+
+    Strings, buffers and mmaps are scanned as they are, only the tokens
+    are copied out of them.  A bytearray is scanned through a buffer, so
+    its tokens come out as Strings.  re can't scan a memoryview, it is
+    copied whole: strings and comments may end past the part of it the
+    tokenizer looks at.
+
+    data - One of DATA_TYPES.
+
+    Returns a String, buffer or mmap.
+    """
+    if isinstance(data, bytearray):
+        return buffer(data)
+    if is_py27 and isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+def finder(data):
+    """
+    Internal: Get the find method of data, buffers lack one.
+
+    Returns a function of a String and a start Integer position, giving
+    the position of the String or -1.
+    """
+    find = getattr(data, 'find', None)
+    if find is None:
+        def find(sub, start=0):
+            m = compile(escape(sub)).search(data, start)
+            return -1 if m is None else m.start()
+    return find
+
+
+def skip_string(data, pos, quote, find=None):
+    """
+    Internal: Find the end of a quoted string.
+
+    data  - String being scanned.
+    pos   - Integer position right after the opening quote.
+    quote - String quote character.
+    find  - Optional find function of data, see finder.
+
+    Returns the Integer position right after the closing quote, the
+    first one not escaped by a backslash, or None if there is none.
+    """
+    find = find or data.find
+    i = find(quote, pos + 1)
+    while i > 0 and data[i - 1] == '\\':
+        i = find(quote, i + 1)
+    if i < 0:
+        return
+    return i + 1
 
 
 class Tokenizer(object):
 
+    # Position where scan_tokens stopped
+    pos = 0
+
     def __repr__(self):
         return '<Tokenizer>'
 
@@ -70,11 +157,221 @@ class Tokenizer(object):
         """
         Public: Extract tokens from data
 
-        data - String to tokenize
+        data - String to tokenize, or a buffer, bytearray, mmap or
+               memoryview of it, see scannable.
 
         Returns Array of token Strings.
         """
-        return cls().extract_tokens(data)
+        return list(cls.iter_tokens(data))
+
+    @classmethod
+    def iter_tokens(cls, data):
+        """
+        Public: Generate tokens from data, as they are found.
+
+        Gives the tokens of tokenize without building the Array, for
+        consumers counting them or stopping early.
+
+        data - String to tokenize, or a buffer, bytearray, mmap or
+               memoryview of it, see scannable.
+
+        Examples
+
+          for token in Tokenizer.iter_tokens(data):
+              counts[token] += 1
+
+          f = open('huge.h')
+          Tokenizer.iter_tokens(mmap(f.fileno(), 0, access=ACCESS_READ))
+
+        Returns a generator of token Strings.
+        """
+        return cls().scan_tokens(data)
+
+    @classmethod
+    def count_tokens(cls, data, max_distinct=None):
+        """
+        Public: Count the tokens of data as they are found.
+
+        Memory is bounded by the number of distinct tokens, not by the
+        length of data.
+
+        data         - String to tokenize, or a buffer, bytearray, mmap
+                       or memoryview of it, see scannable.
+        max_distinct - Optional Integer number of distinct tokens to
+                       count at most.  Tokens first found once that many
+                       are counted are dropped, the others still counted.
+
+        Examples
+
+          Tokenizer.count_tokens("int x; int y;")
+          # => {'int': 2, 'x': 1, ';': 2, 'y': 1}
+
+        Returns a Hash of token String to Integer occurrences.
+        """
+        counts = {}
+        get = counts.get
+        if max_distinct is None:
+            for token in cls.iter_tokens(data):
+                counts[token] = get(token, 0) + 1
+            return counts
+
+        for token in cls.iter_tokens(data):
+            count = get(token)
+            if count is not None:
+                counts[token] = count + 1
+            elif len(counts) < max_distinct:
+                counts[token] = 1
+        return counts
+
+    @classmethod
+    def count_token_ids(cls, data, vocabulary):
+        """
+        Public: Count the tokens of data a vocabulary knows, by id.
+
+        Unknown tokens are dropped as they are found, only their number
+        is kept.
+
+        data       - String to tokenize, or a buffer, bytearray, mmap or
+                     memoryview of it, see scannable.  Unicode data is
+                     tokenized as UTF-8, the way models keep tokens.
+        vocabulary - Hash of token String to Integer id, looked up for
+                     every token, or a function giving the id of a token
+                     or None, like Model.token_id, called once for every
+                     distinct token.  See Model.token_lookup.
+
+        Examples
+
+          Tokenizer.count_token_ids("int x; int y;", {'int': 0, ';': 1})
+          # => ({0: 2, 1: 2}, 6)
+
+        Returns a pair of a Hash of Integer token id to Integer
+        occurrences, and the Integer number of occurrences of all tokens,
+        unknown ones included.
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        counts = {}
+        get = counts.get
+        occurrences = 0
+        if isinstance(vocabulary, dict):
+            token_id = vocabulary.get
+            for token in cls.iter_tokens(data):
+                occurrences += 1
+                i = token_id(token)
+                if i is not None:
+                    counts[i] = get(i, 0) + 1
+            return counts, occurrences
+        # Every distinct token is looked up once, tokens of a hashed
+        # vocabulary can share an id
+        for token, count in cls.count_tokens(data).iteritems():
+            occurrences += count
+            i = vocabulary(token)
+            if i is not None:
+                counts[i] = get(i, 0) + count
+        return counts, occurrences
+
+    @classmethod
+    def tokenize_stream(cls, stream):
+        """
+        Public: Extract tokens from a file object or chunks of data.
+
+        Only what tokenize looks at is read, see read.
+
+        stream - File-like object or iterable of String chunks.
+
+        Returns Array of token Strings.
+        """
+        return cls.tokenize(cls.read(stream))
+
+    @classmethod
+    def read(cls, stream, limit=BYTE_LIMIT + READ_AHEAD):
+        """
+        Public: Read the start of a stream, up to a limit.
+
+        Tokenizing stops at BYTE_LIMIT, reading stops shortly after, so
+        memory stays bounded by the limit however large the stream is.
+        Tokens are the same as for the whole data, unless a token, string
+        or comment starting before BYTE_LIMIT runs past the limit.
+
+        stream - File-like object or iterable of String chunks.
+        limit  - Integer number of bytes to read at most.
+
+        Examples
+
+          Tokenizer.read(open('huge.h'))
+          Tokenizer.read(iter(['#include <stdio.h>\n', 'int main() {}']))
+
+        Returns a String.
+        """
+        return ''.join(cls.read_chunks(stream, limit))
+
+    @classmethod
+    def read_chunks(cls, stream, limit=BYTE_LIMIT + READ_AHEAD):
+        """
+        Internal: Generate the chunks of a stream, up to a limit.
+
+        stream - File-like object or iterable of String chunks.
+        limit  - Integer number of bytes to read at most.
+
+        Returns a generator of Strings.
+        """
+        size = 0
+        if hasattr(stream, 'read'):
+            while size < limit:
+                chunk = stream.read(min(READ_SIZE, limit - size))
+                if not chunk:
+                    break
+                size += len(chunk)
+                yield chunk
+        else:
+            for chunk in stream:
+                chunk = chunk[:limit - size]
+                size += len(chunk)
+                yield chunk
+                if size >= limit:
+                    break
+
+    @classmethod
+    def stream_tokens(cls, stream):
+        """
+        Public: Generate tokens from a file object or chunks of data, as
+        they are read.
+
+        Gives the tokens of tokenize_stream, but a step of the scanner
+        only runs once READ_AHEAD bytes past it were read, or a string or
+        comment it opens was closed, so the stream is read as the tokens
+        are consumed.  Stopping the iteration stops the reading.
+
+        stream - File-like object or iterable of String chunks.
+
+        Examples
+
+          for token in Tokenizer.stream_tokens(open('huge.h')):
+              print token
+
+        Returns a generator of token Strings.
+        """
+        tokenizer = cls()
+        chunks = cls.read_chunks(stream)
+        data, pending, size, final = '', [], 0, False
+        while not final:
+            # Data is scanned again from the last complete step once
+            # READ_SIZE more bytes are in
+            for chunk in chunks:
+                pending.append(chunk)
+                size += len(chunk)
+                if size >= READ_SIZE:
+                    break
+            else:
+                final = True
+            data += ''.join(pending)
+            pending, size = [], 0
+
+            end = None if final else len(data) - READ_AHEAD
+            for token in tokenizer.scan_tokens(data, tokenizer.pos, end):
+                yield token
+            if tokenizer.pos >= BYTE_LIMIT:
+                break
 
     def extract_tokens(self, data):
         """
@@ -89,75 +386,81 @@ class Tokenizer(object):
 
         Returns Array of token Strings.
         """
-        s = StringScanner(data)
-        tokens = []
-        while not s.is_eos:
-            if s.pos >= BYTE_LIMIT:
+        return list(self.scan_tokens(data))
+
+    def scan_tokens(self, data, pos=0, end=None):
+        """
+        Internal: Generate tokens from data.
+
+        Every step is a single match of REGEX_STEP, strings and comments
+        are then skipped by looking for their end.  Scanning stops at
+        BYTE_LIMIT, and leaves self.pos where it stopped.
+
+        data - String to scan, or one of DATA_TYPES.
+        pos  - Integer position to start scanning from.
+        end  - Optional Integer position, for data that is only the start
+               of more data.  Scanning stops at the first step that
+               ends past it, or that skips a string or comment whose end
+               isn't in data yet: more data could change them.
+
+        Returns a generator of token Strings.
+        """
+        data = scannable(data)
+        match, find = REGEX_STEP.match, finder(data)
+        size = len(data)
+        self.pos = pos
+        while pos < size:
+            if pos >= BYTE_LIMIT:
                 break
-            token = s.scan(REGEX_SHEBANG)
-            if token:
-                name = self.extract_shebang(token)
-                if name:
-                    tokens.append('SHEBANG#!%s' % name)
-                continue
+            m = match(data, pos)
+            start, pos = pos, m.end()
+            kind = m.lastgroup
+            tokens = ()
+            complete = True
 
-            # Single line comment
-            if s.is_bol and s.scan(START_SINGLE_LINE_COMMENT):
-                s.skip_until(REGEX_BOL)
-                continue
+            if kind == 'token':
+                tokens = (m.group(kind),)
 
-            # Multiline comments
-            token = s.scan(START_MULTI_LINE_COMMENT)
-            if token:
-                close_token = MULTI_LINE_COMMENT_DICT[token]
-                s.skip_until(close_token)
-                continue
+            elif kind is None:
+                pass
+
+            elif kind == 'sgml':
+                tokens = self.scan_sgml_tokens(m.group())
 
             # Skip single or double quoted strings
-            if s.scan(REGEX_DOUBLE_QUOTE):
-                if s.peek(1) == '"':
-                    s.getch
+            elif kind == 'quote':
+                i = skip_string(data, pos, m.group(), find)
+                if i is None:
+                    complete = False
                 else:
-                    s.skip_until(REGEX_DOUBLE_END_QUOTE)
-                continue
-            if s.scan(REGEX_SINGLE_QUOTE):
-                if s.peek(1) == "'":
-                    s.getch
-                else:
-                    s.skip_until(REGEX_SINGLE_END_QUOTE)
-                continue
-
-            # Skip number literals
-            if s.scan(REGEX_NUMBER_LITERALS):
-                continue
-
-            # SGML style brackets
-            token = s.scan(REGEX_SGML)
-            if token:
-                for t in self.extract_sgml_tokens(token):
-                    tokens.append(t)
-                continue
+                    pos = i
 
-            # Common programming punctuation
-            token = s.scan(REGEX_COMMON_PUNCTUATION)
-            if token:
-                tokens.append(token)
-                continue
+            # Single line comment
+            elif kind == 'single_line_comment':
+                i = find('\n', pos)
+                pos = size if i < 0 else i + 1
 
-            # Regular token
-            token = s.scan(REGEX_REGULAR_TOKEN)
-            if token:
-                tokens.append(token)
-                continue
+            # Multiline comments
+            elif kind == 'multi_line_comment':
+                close_token = MULTI_LINE_COMMENT_DICT[m.group()]
+                i = find(close_token, pos)
+                if i < 0:
+                    complete = False
+                else:
+                    pos = i + len(close_token)
 
-            # Common operators
-            token = s.scan(REGEX_COMMON_OPERATORS)
-            if token:
-                tokens.append(token)
-                continue
+            else:
+                name = self.extract_shebang(m.group())
+                if name:
+                    tokens = ('SHEBANG#!%s' % name,)
 
-            s.getch
-        return tokens
+            if end is not None and (not complete or pos > end):
+                pos = start
+                break
+            for token in tokens:
+                yield token
+            self.pos = pos
+        self.pos = pos
 
     @classmethod
     def extract_shebang(cls, data):
@@ -174,15 +477,19 @@ class Tokenizer(object):
 
         Returns String token or nil it couldn't be parsed.
         """
-        s = StringScanner(data)
-        path = s.scan(REGEX_SHEBANG_FULL)
-        if path:
+        m = REGEX_SHEBANG_FULL.match(data)
+        if m:
+            path = m.group()
             script = path.split('/')[-1]
             if script == 'env':
-                s.scan(REGEX_SHEBANG_WHITESPACE)
-                script = s.scan(REGEX_SHEBANG_NON_WHITESPACE)
+                pos = m.end()
+                m = REGEX_SHEBANG_WHITESPACE.match(data, pos)
+                if m:
+                    pos = m.end()
+                m = REGEX_SHEBANG_NON_WHITESPACE.match(data, pos)
+                script = m and m.group()
             if script:
-                script = compile(r'[^\d]+').match(script).group(0)
+                script = REGEX_SHEBANG_SCRIPT.match(script).group(0)
             return script
         return
 
@@ -199,42 +506,51 @@ class Tokenizer(object):
 
         Returns Array of token Strings.
         """
-        s = StringScanner(data)
-        tokens = []
-        append = tokens.append
+        return list(self.scan_sgml_tokens(data))
+
+    def scan_sgml_tokens(self, data):
+        """
+        Internal: Generate tokens from inside SGML tag.
+
+        data - SGML tag String.
+
+        Returns a generator of token Strings.
+        """
+        pos, size = 0, len(data)
 
-        while not s.is_eos:
+        while pos < size:
             # Emit start token
-            token = s.scan(REGEX_EMIT_START_TOKEN)
-            if token:
-                append(token + '>')
+            m = REGEX_EMIT_START_TOKEN.match(data, pos)
+            if m:
+                yield m.group() + '>'
+                pos = m.end()
                 continue
 
             # Emit attributes with trailing =
-            token = s.scan(REGEX_EMIT_TRAILING)
-            if token:
-                append(token)
+            m = REGEX_EMIT_TRAILING.match(data, pos)
+            if m:
+                yield m.group()
+                pos = m.end()
 
                 # Then skip over attribute value
-                if s.scan(REGEX_DOUBLE_QUOTE):
-                    s.skip_until(REGEX_DOUBLE_END_QUOTE)
-                    continue
-                if s.scan(REGEX_SINGLE_QUOTE):
-                    s.skip_until(REGEX_SINGLE_END_QUOTE)
+                quote = data[pos:pos + 1]
+                if quote in ('"', "'"):
+                    i = skip_string(data, pos + 1, quote)
+                    pos = pos + 1 if i is None else i
                     continue
-                s.skip_until(REGEX_EMIT_WORD)
+                m = REGEX_EMIT_WORD.search(data, pos)
+                if m:
+                    pos = m.end()
                 continue
 
             # Emit lone attributes
-            token = s.scan(REGEX_EMIT_WORD)
-            if token:
-                append(token)
+            m = REGEX_EMIT_WORD.match(data, pos)
+            if m:
+                yield m.group()
+                pos = m.end()
 
             # Stop at the end of the tag
-            if s.scan(REGEX_EMIT_END_TAG):
-                s.terminate
-                continue
-
-            s.getch
+            if data[pos:pos + 1] == '>':
+                break
 
-        return tokens
+            pos += 1
@@ -23,7 +23,6 @@ setup(name='linguist',
       install_requires=['PyYAML',
                         'pygments-github-lexers>=0.0.3',
                         'charlockholmes',
-                        'mime>=0.1.0',
-                        'scanner>=0.0.4'],
+                        'mime>=0.1.0'],
       classifiers=[],
-      scripts=['bin/pylinguist'])
+      scripts=['bin/pylinguist', 'bin/pylinguist-compact'])
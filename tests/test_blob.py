@@ -3,8 +3,9 @@
 from os.path import realpath, dirname, join
 from pygments.lexers import find_lexer_class
 from framework import LinguistTestBase, main
+from libs.classifier import Classifier
 from libs.file_blob import FileBlob
-from libs.samples import Samples
+from libs.samples import DATA, Samples
 
 DIR = dirname(dirname(realpath(__file__)))
 SAMPLES_PATH = join(DIR, "samples")
@@ -61,6 +62,13 @@ class TestFileBob(LinguistTestBase):
     def test_data(self):
         assert "module Foo\nend\n" == self.blob("Ruby/foo.rb").data
 
+    def test_map(self):
+        blob = self.blob("Objective-C/Foo.h")
+        data = blob.map()
+        assert blob.data == data[:]
+        assert "Objective-C" == Classifier.classify_top(DATA, data, ["C", "C++", "Objective-C"])
+        data.close()
+
     def test_lines(self):
         assert ["module Foo", "end", ""] == self.blob("Ruby/foo.rb").lines
         assert ["line 1", "line 2", ""] == self.blob("Text/mac.txt").lines
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from framework import LinguistTestBase, main
+from libs.cache import LRUCache
+
+
+class TestCache(LinguistTestBase):
+
+    def test_get(self):
+        cache = LRUCache(2)
+        assert None == cache.get('a')
+        cache.set('a', 1)
+        assert 1 == cache.get('a')
+        assert 'none' == cache.get('b', 'none')
+        assert {'hits': 1, 'misses': 2, 'evictions': 0, 'entries': 1, 'size': 2} == cache.stats()
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert 2 == len(cache)
+        assert 1 == cache.evictions
+        assert None == cache.get('b')
+        assert 1 == cache.get('a')
+        assert 3 == cache.get('c')
+
+        cache.set('a', 4)
+        cache.set('d', 5)
+        assert None == cache.get('c')
+        assert 4 == cache.get('a')
+        assert 2 == cache.evictions
+
+    def test_clear(self):
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        assert 0 == len(cache)
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.clear()
+        assert 0 == len(cache)
+        assert 0 == cache.hits
+
+    def test_digest(self):
+        assert LRUCache.digest('foo') == LRUCache.digest(u'foo')
+        assert LRUCache.digest('foo') != LRUCache.digest('bar')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import math
+import sys
+from StringIO import StringIO
 from framework import LinguistTestBase, main
+from libs.cache import LRUCache
 from libs.classifier import Classifier
-from libs.tokenizer import Tokenizer
+from libs.matrix_classifier import MatrixClassifier
+from libs.tokenizer import BYTE_LIMIT, READ_AHEAD, Tokenizer
 from libs.samples import DATA
 
 TEST_FILE = "../samples/%s"
@@ -25,6 +30,72 @@ class TestClassifier(LinguistTestBase):
         rs = Classifier.classify(db, tokens)
         assert "Objective-C" == rs[0][0]
 
+    def test_train_counts(self):
+        db = {}
+        Classifier.train(db, "Ruby", "def hello; end")
+        Classifier.train(db, "Ruby", "def world; end")
+        Classifier.train(db, "Python", "")
+        assert {"Ruby": {"def": 2, "hello": 1, "world": 1, ";": 2, "end": 2}} == db['tokens']
+        assert {"Ruby": 8} == db['language_tokens']
+        assert {"Ruby": 2, "Python": 1} == db['languages']
+        assert (8, 3) == (db['tokens_total'], db['languages_total'])
+
+        counted = {}
+        Classifier.train_counts(counted, "Ruby", {"def": 1, "hello": 1, ";": 1, "end": 1})
+        Classifier.train_counts(counted, "Ruby", {"def": 1, "world": 1, ";": 1, "end": 1})
+        Classifier.train_counts(counted, "Python", {})
+        assert db == counted
+
+    def test_merge(self):
+        db = {}
+        Classifier.train(db, "Ruby", self.fixture("Ruby/foo.rb"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.h"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.m"))
+
+        first, second = {}, {}
+        Classifier.train(first, "Ruby", self.fixture("Ruby/foo.rb"))
+        Classifier.train(first, "Objective-C", self.fixture("Objective-C/Foo.h"))
+        Classifier.train(second, "Objective-C", self.fixture("Objective-C/Foo.m"))
+        merged = {}
+        Classifier.merge(merged, first)
+        Classifier.merge(merged, second)
+        assert db == merged
+
+    def test_explain(self):
+        db = {}
+        Classifier.train(db, "Ruby", self.fixture("Ruby/foo.rb"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.h"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.m"))
+        data = self.fixture("Objective-C/hello.m")
+        languages = ["Objective-C", "Ruby"]
+
+        explanation = Classifier.explain(db, data, languages)
+        assert Classifier.classify(db, data, languages) == explanation['languages']
+        assert len(Tokenizer.tokenize(data)) == explanation['occurrences']
+        assert len(set(Tokenizer.tokenize(data))) == len(explanation['tokens'])
+        unseen = explanation['unseen_log_probability']
+        for language, score in explanation['languages']:
+            points = sum([token['points'].get(language, 0.0) for token in explanation['tokens']])
+            total = explanation['priors'][language] + explanation['occurrences'] * unseen + points
+            assert abs(score - total) < 1e-9
+        assert "#import" == explanation['tokens'][0]['token']
+        assert ["Objective-C"] == explanation['tokens'][0]['points'].keys()
+
+        text = Classifier.format_explanation(explanation)
+        assert 2 == len(text.splitlines())
+        assert text.startswith("%20s = " % "Objective-C")
+        text = Classifier.format_explanation(explanation, 2)
+        assert "#import" in text and "occurrences" in text
+
+        classifier = Classifier(db)
+        classifier.verbosity = 2
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            assert explanation['languages'] == classifier._classify(data, languages)
+            assert text == sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
     def test_restricted_classify(self):
         db = {}
         Classifier.train(db, "Ruby", self.fixture("Ruby/foo.rb"))
@@ -37,6 +108,141 @@ class TestClassifier(LinguistTestBase):
         rs = Classifier.classify(db, self.fixture("Objective-C/hello.m"), ["Ruby"])
         assert "Ruby" == rs[0][0]
 
+    def test_classify_many(self):
+        items = [(self.fixture("Objective-C/hello.m"), ["C", "C++", "Objective-C"]),
+                 (self.fixture("Ruby/foo.rb"), []),
+                 (None, ["C", "Objective-C"]),
+                 (self.fixture("C++/bar.h"), ["Objective-C", "C++", "C"])]
+        available = MatrixClassifier.available
+        Classifier.matrix = True
+        try:
+            for flag in (available, False):
+                MatrixClassifier.available = flag
+                rs = Classifier.classify_many(DATA, items)
+                assert 4 == len(rs)
+                for (data, languages), r in zip(items, rs):
+                    expected = Classifier.classify(DATA, data, languages)
+                    assert sorted([l for l, _ in expected]) == sorted([l for l, _ in r])
+                    if expected:
+                        assert expected[0][0] == r[0][0]
+                assert ["Objective-C", "Ruby", "C++"] == [rs[0][0][0], rs[1][0][0], rs[3][0][0]]
+                assert [] == rs[2]
+        finally:
+            MatrixClassifier.available = available
+            Classifier.matrix = False
+
+    def test_classify_top(self):
+        names = ["C/hello.h", "C++/bar.h", "Objective-C/Foo.h", "Objective-C/hello.m",
+                 "Perl/fib.pl", "Prolog/turing.pl", "Ruby/foo.rb"]
+        for name in names:
+            data = self.fixture(name)
+            for languages in ([], ["C", "C++", "Objective-C"], ["Perl", "Prolog"]):
+                expected = Classifier.classify(DATA, data, languages)[0][0]
+                assert expected == Classifier.classify_top(DATA, data, languages), name
+        assert "Ruby" == Classifier.classify_top(DATA, "", ["Ruby"])
+        assert None == Classifier.classify_top(DATA, None)
+
+    def test_classify_stream(self):
+        languages = ["C", "C++", "Objective-C"]
+        expected = Classifier.classify(DATA, self.fixture("Objective-C/Foo.h"), languages)
+        stream = open(TEST_FILE % "Objective-C/Foo.h")
+        assert expected == Classifier.classify_stream(DATA, stream, languages)
+
+    def test_classify_early(self):
+        data = self.fixture("Objective-C/Foo.h")
+        languages = ["C", "C++", "Objective-C"]
+        expected = dict(Classifier.classify(DATA, data, languages))
+        results, stopped = Classifier.classify_early(DATA, [data], languages)
+        assert not stopped
+        assert sorted(expected) == sorted(dict(results))
+        for language, score in results:
+            assert abs(score - expected[language]) < 1e-6
+
+        data = self.fixture("Objective-C/hello.m")
+        read = []
+
+        def chunks():
+            for i in xrange(1000):
+                read.append(i)
+                yield data
+
+        results, stopped = Classifier.classify_early(DATA, chunks(), languages, 20.0, 100)
+        assert stopped
+        assert "Objective-C" == results[0][0]
+        assert len(read) < 1000
+        assert ([], False) == Classifier.classify_early({}, [data])
+
+    def test_cache(self):
+        data = self.fixture("Objective-C/Foo.h")
+        languages = ["C", "C++", "Objective-C"]
+        expected = Classifier.classify(DATA, data, languages)
+
+        iter_tokens, calls = Tokenizer.iter_tokens, []
+        Classifier.cache = LRUCache(2)
+        Tokenizer.iter_tokens = staticmethod(lambda data: calls.append(data) or iter_tokens(data))
+        try:
+            assert expected == Classifier.classify(DATA, data, languages)
+            assert expected == Classifier.classify(DATA, data, list(reversed(languages)))
+            assert "Objective-C" == Classifier.classify_top(DATA, data, languages)
+            assert "Objective-C" == Classifier.classify_top(DATA, data, languages)
+            assert [expected] == Classifier.classify_many(DATA, [(data, languages)])
+            assert 2 == len(calls)
+            stats = Classifier.cache.stats()
+            assert (3, 2, 0) == (stats['hits'], stats['misses'], stats['evictions'])
+
+            Classifier.classify(DATA, "int main() {}", languages)
+            assert 1 == Classifier.cache.evictions
+            # Databases without an md5 can change, their results aren't cached
+            Classifier.classify({}, data)
+            assert 2 == Classifier.cache.stats()['entries']
+        finally:
+            Classifier.cache = None
+            Tokenizer.iter_tokens = iter_tokens
+
+    def test_cache_key(self):
+        digests, digest = [], LRUCache.digest
+        Classifier.cache = LRUCache(2)
+        Classifier.cache.digest = lambda data: digests.append(len(data)) or digest(data)
+        try:
+            data = 'int x;\n' * BYTE_LIMIT
+            key = Classifier.cache_key('classify', data, ["C"], 'md5')
+            assert [BYTE_LIMIT + READ_AHEAD] == digests
+            # Data past what the tokenizer reads still counts by its length
+            assert key == Classifier.cache_key('classify', data[:-2] + ':\n', ["C"], 'md5')
+            assert key != Classifier.cache_key('classify', data[:-7], ["C"], 'md5')
+            assert key != Classifier.cache_key('classify', 'y' + data[1:], ["C"], 'md5')
+            assert (Classifier.cache_key('classify', buffer(data), ["C"], 'md5') ==
+                    Classifier.cache_key('classify', data, ["C"], 'md5'))
+        finally:
+            Classifier.cache = None
+
+    def test_candidate_indexes(self):
+        db = {}
+        Classifier.train(db, "Ruby", self.fixture("Ruby/foo.rb"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.h"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.m"))
+        classifier = Classifier(db)
+        classifier.build_candidate_indexes([["Ruby", "Objective-C"]])
+
+        languages, index = classifier.candidate_indexes[frozenset(["Ruby", "Objective-C"])]
+        assert ("Objective-C", "Ruby") == languages
+        token_id = classifier.model.token_id
+        assert token_id("module") in index
+        assert token_id("@interface") in index
+        assert token_id("printf") not in index
+        data = self.fixture("Objective-C/hello.m")
+        assert "Objective-C" == classifier._classify_top(data, ["Ruby", "Objective-C"])
+
+    def test_candidate_sets(self):
+        classifier = Classifier(DATA)
+        classifier.candidate_sets.add(frozenset(["C", "C++", "Objective-C"]))
+        data = self.fixture("Objective-C/Foo.h")
+        assert "Objective-C" == classifier._classify_top(data, ["Perl", "Prolog", "Objective-C"])
+        assert {} == classifier.candidate_indexes
+        # Only the set asked for is indexed
+        assert "Objective-C" == classifier._classify_top(data, ["C", "C++", "Objective-C"])
+        assert [frozenset(["C", "C++", "Objective-C"])] == classifier.candidate_indexes.keys()
+
     def test_instance_classify_empty(self):
         rs = Classifier.classify(DATA, "")
         r = rs[0]
@@ -45,6 +251,19 @@ class TestClassifier(LinguistTestBase):
     def test_instance_classify_none(self):
         assert [] == Classifier.classify(DATA, None)
 
+    def test_tokens_probability(self):
+        classifier = Classifier.load(DATA)
+        tokens = Tokenizer.tokenize(self.fixture("Objective-C/hello.m")) + ['not-a-known-token']
+        for language in ('Objective-C', 'C', 'Ruby'):
+            expected = sum([math.log(classifier.token_probability(t, language)) for t in tokens])
+            assert abs(expected - classifier.tokens_probability(tokens, language)) < 1e-9
+
+    def test_load(self):
+        assert Classifier.load(DATA) is Classifier.load(DATA)
+        db = {}
+        Classifier.train(db, "Ruby", self.fixture("Ruby/foo.rb"))
+        assert Classifier.load(db) is not Classifier.load(db)
+
     def test_classify_ambiguous_languages(self):
         #TODO
         """
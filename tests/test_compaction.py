@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from framework import LinguistTestBase, main
+from libs.classifier import Classifier, count_tokens
+from libs.compaction import Compaction
+from libs.tokenizer import Tokenizer
+
+TEST_FILE = "../samples/%s"
+
+
+class TestCompaction(LinguistTestBase):
+
+    def fixture(self, name):
+        return open(TEST_FILE % name).read()
+
+    def documents(self):
+        documents = []
+        for language, name in [("Ruby", "Ruby/foo.rb"), ("Ruby", "Ruby/grit.rb"),
+                               ("Objective-C", "Objective-C/Foo.h"), ("Objective-C", "Objective-C/Foo.m"),
+                               ("Objective-C", "Objective-C/hello.m"), ("C", "C/hello.h"),
+                               ("C", "C/hello.c")]:
+            tokens = Tokenizer.tokenize(self.fixture(name))
+            documents.append({'language': language, 'extname': name[name.rindex('.'):],
+                              'tokens': tokens, 'counts': count_tokens(tokens), 'data': self.fixture(name)})
+        return documents
+
+    def train(self, documents):
+        db = {'extnames': {'Ruby': ['.rb'], 'Objective-C': ['.h', '.m'], 'C': ['.c', '.h']}}
+        for document in documents:
+            Classifier.train(db, document['language'], document['data'])
+        return db
+
+    def test_prune(self):
+        db = {}
+        Classifier.train(db, "Ruby", "def hello; puts 1; end; def world; end")
+        Classifier.train(db, "Python", "def hello(): pass")
+
+        pruned = Compaction.prune(db, min_count=2)
+        assert {"Ruby": {"def": 2, "hello": 1, "end": 2, ";": 4},
+                "Python": {"def": 1, "hello": 1}} == pruned['tokens']
+        assert db['language_tokens'] == pruned['language_tokens']
+        assert 'md5' in pruned
+
+        pruned = Compaction.prune(db, max_tokens=1)
+        assert 1 == len(set(pruned['tokens']['Ruby']) | set(pruned['tokens']['Python']))
+
+    def test_information_gains(self):
+        db = {}
+        Classifier.train(db, "Ruby", "def end end end")
+        Classifier.train(db, "Python", "def pass pass pass")
+        gains = Compaction.information_gains(db)
+        # def is seen as much in both languages, it tells nothing
+        assert abs(gains['def']) < 1e-9
+        assert gains['end'] > 0.1
+        assert abs(gains['end'] - gains['pass']) < 1e-9
+
+    def test_leave_one_out(self):
+        documents = self.documents()
+        db = self.train(documents)
+
+        # The database is pruned inside every fold, without the sample
+        for min_count, max_tokens in ((1, None), (2, None), (1, 10), (2, 5)):
+            correct = 0
+            for i, document in enumerate(documents):
+                rest = self.train(documents[:i] + documents[i + 1:])
+                rest = Compaction.prune(rest, min_count, max_tokens)
+                languages = [l for l in db['languages'] if l in rest['languages']]
+                scores = Classifier.classify(rest, document['tokens'], languages)
+                correct += scores[0][0] == document['language']
+
+            results = Compaction.leave_one_out(db, documents, min_count, max_tokens)
+            assert (correct, len(documents)) == results['all'], (min_count, max_tokens)
+            # Only .h is ambiguous
+            assert 2 == results['ambiguous'][1]
+
+        # A token seen once besides the sample is pruned in its fold, even
+        # though pruning the whole database keeps it
+        db = {}
+        Classifier.train(db, "Ruby", "def hello; end")
+        Classifier.train(db, "Python", "def hello(): pass")
+        document = {'language': "Python", 'counts': count_tokens(Tokenizer.tokenize("def hello(): pass"))}
+        assert 'hello' in Compaction.prune(db, 2)['tokens']['Ruby']
+        kept = Compaction.fold_keep(db, Compaction.postings(db), None, document, 2, 10)
+        assert set() == kept
+        totals = {'def': 2, 'hello': 2, '(': 1, ')': 1, 'pass': 1}
+        assert set() == Compaction.fold_keep(db, None, totals, document, 2)
+
+    def test_report(self):
+        documents = self.documents()
+        db = self.train(documents)
+        rows = Compaction.report([(2, None)], db, documents)
+        assert [(1, None), (2, None)] == [(row['min_count'], row['max_tokens']) for row in rows]
+        assert rows[0]['tokens'] > rows[1]['tokens'] > 0
+        assert rows[0]['bytes'] > rows[1]['bytes']
+        assert 3 == len(Compaction.format_report(rows).splitlines())
+
+
+if __name__ == '__main__':
+    main()
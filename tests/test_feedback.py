@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import os
+import tempfile
+
+from framework import LinguistTestBase, main
+from libs.classifier import Classifier
+from libs.feedback import FeedbackModel
+from libs.md5 import MD5
+from libs.model import Model, HashedModel, MappedModel
+from libs.samples import Samples
+
+TEST_FILE = "../samples/%s"
+
+
+class TestFeedback(LinguistTestBase):
+
+    def fixture(self, name):
+        return open(TEST_FILE % name).read()
+
+    def db(self):
+        db = {}
+        Classifier.train(db, "Ruby", self.fixture("Ruby/foo.rb"))
+        Classifier.train(db, "Ruby", self.fixture("Ruby/grit.rb"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.h"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.m"))
+        return db
+
+    def assert_same_scores(self, model, expected, documents):
+        for document in documents:
+            scores = dict(Classifier(model)._classify(document, expected.languages))
+            for language, score in Classifier(expected)._classify(document, expected.languages):
+                assert abs(score - scores[language]) < 1e-9
+            assert (Classifier(expected)._classify_top(document, expected.languages) ==
+                    Classifier(model)._classify_top(document, expected.languages))
+
+    def test_train(self):
+        db = self.db()
+        model = FeedbackModel(Model.from_db(db))
+        model.train("Objective-C", self.fixture("Objective-C/hello.m"))
+        model.train("C", self.fixture("C/hello.c"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/hello.m"))
+        Classifier.train(db, "C", self.fixture("C/hello.c"))
+
+        expected = Model.from_db(db)
+        assert (db['tokens_total'], db['languages_total']) == (model.tokens_total, model.languages_total)
+        for language, tokens in db['tokens'].iteritems():
+            for token, count in tokens.iteritems():
+                assert count == model.count(token, language)
+        self.assert_same_scores(model, expected, [self.fixture("Objective-C/FooAppDelegate.h"),
+                                                  self.fixture("Ruby/foo.rb"),
+                                                  self.fixture("C/hello.h")])
+        for token in expected.tokens:
+            token_id = expected.token_id(token)
+            assert model.token_gaps[model.token_id(token)] >= expected.token_gaps[token_id] - 1e-9
+
+    def test_untrain(self):
+        db = self.db()
+        base = Model.from_db(db)
+        model = FeedbackModel(base)
+        model.train("Ruby", self.fixture("Objective-C/hello.m"))
+        model.untrain("Ruby", self.fixture("Objective-C/hello.m"))
+        assert (base.tokens_total, base.languages_total) == (model.tokens_total, model.languages_total)
+        assert 0 == model.count("@end", "Ruby")
+        self.assert_same_scores(model, base, [self.fixture("Objective-C/FooAppDelegate.h")])
+
+        md5, tokens_total = model.md5, model.tokens_total
+        for language, name in (("Ruby", "Objective-C/hello.m"), ("Python", "Ruby/foo.rb")):
+            try:
+                model.untrain(language, self.fixture(name))
+            except ValueError:
+                pass
+            else:
+                assert False, "untrained counts %s didn't have" % language
+        assert (md5, tokens_total) == (model.md5, model.tokens_total)
+
+    def test_hashed(self):
+        db = self.db()
+        model = FeedbackModel(HashedModel.from_db(db, 1 << 10))
+        model.train("Objective-C", self.fixture("Objective-C/hello.m"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/hello.m"))
+        expected = HashedModel.from_db(db, 1 << 10)
+        self.assert_same_scores(model, expected, [self.fixture("Objective-C/FooAppDelegate.h")])
+        assert list(expected.posting_counts) == list(model.freeze().posting_counts)
+
+    def test_freeze(self):
+        db = self.db()
+        model = FeedbackModel(Model.from_db(db))
+        assert model.base is model.tables()
+        model.train("C", self.fixture("C/hello.c"))
+        Classifier.train(db, "C", self.fixture("C/hello.c"))
+
+        frozen, expected = model.freeze(), Model.from_db(db)
+        assert model.md5 == frozen.md5
+        assert sorted(expected.tokens) == sorted(frozen.tokens)
+        for token in expected.tokens:
+            for language in expected.languages:
+                assert expected.count(token, language) == frozen.count(token, language)
+
+        classifier = Classifier.load(model)
+        classifier.build_candidate_indexes([["C", "Objective-C"]])
+        assert classifier.candidate_md5 == model.md5
+        assert "C" == Classifier.classify_top(model, self.fixture("C/hello.c"), ["C", "Objective-C"])
+
+    def test_attached(self):
+        fd, path = tempfile.mkstemp(suffix='.model')
+        os.close(fd)
+        model = Samples.model()
+        try:
+            Samples.publish(path, [["Perl", "Prolog"]])
+            base = MappedModel.open(path, copy=False)
+        finally:
+            Samples._model = model
+            os.remove(path)
+
+        languages = ["Perl", "Prolog"]
+        data = self.fixture("Perl/fib.pl")
+        assert "Perl" == Classifier.classify_top(base, data, languages)
+        feedback = FeedbackModel(base)
+        for i in xrange(30):
+            feedback.train("Prolog", data)
+        # The shipped indexes were built for the base file, not the deltas
+        assert "Prolog" == Classifier.classify(feedback, data, languages)[0][0]
+        assert "Prolog" == Classifier.classify_top(feedback, data, languages)
+
+    def test_log(self):
+        fd, path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        os.remove(path)
+        try:
+            db = self.db()
+            db['md5'] = MD5.hexdigest(db)
+            model = FeedbackModel(Model.from_db(db), path)
+            model.train("C", self.fixture("C/hello.c"))
+            model.untrain("Ruby", self.fixture("Ruby/foo.rb"))
+            assert 2 == len(open(path).readlines())
+
+            replayed = FeedbackModel(Model.from_db(db), path)
+            assert model.md5 == replayed.md5
+            assert model.deltas == replayed.deltas
+
+            other = copy.deepcopy(db)
+            Classifier.train(other, "C", self.fixture("C/hello.h"))
+            other['md5'] = MD5.hexdigest(other)
+            try:
+                FeedbackModel(Model.from_db(other), path)
+            except ValueError:
+                pass
+            else:
+                assert False, "replayed a log of another model"
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_log_bytes(self):
+        fd, path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        os.remove(path)
+        try:
+            db = self.db()
+            db['md5'] = MD5.hexdigest(db)
+            model = FeedbackModel(Model.from_db(db), path)
+            # Latin-1 and UTF-8 tokens
+            model.train("Python", ["print", "caf\xe9"])
+            model.train("Python", ["print", "caf\xc3\xa9"])
+            assert 1 == model.count("caf\xe9", "Python")
+            assert 1 == model.count("caf\xc3\xa9", "Python")
+
+            replayed = FeedbackModel(Model.from_db(db), path)
+            assert model.md5 == replayed.md5
+            assert model.deltas == replayed.deltas
+            assert 1 == replayed.count("caf\xe9", "Python")
+            assert 1 == replayed.count("caf\xc3\xa9", "Python")
+
+            # A delta that can't be logged isn't applied
+            md5, tokens_total = model.md5, model.tokens_total
+            self.assertRaises(ValueError, model.train, "Caf\xe9", "print")
+            assert (md5, tokens_total) == (model.md5, model.tokens_total)
+            assert 2 == len(open(path).readlines())
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import os
+import tempfile
+
 from pygments.lexers import find_lexer_class
 from framework import LinguistTestBase, main
+from libs.classifier import Classifier
 from libs.language import Language
+from libs.model import Model
+from libs.samples import MODEL_PATH, Samples
 
 
 colorize = """<div class="highlight"><pre><span class="k">def</span> <span class="nf">foo</span>
@@ -233,6 +239,31 @@ class TestLanguage(LinguistTestBase):
         assert [Language['Clojure']] == Language.find_by_filename('riemann.config')
         assert [Language['HTML+Django']] == Language.find_by_filename('index.jinja')
 
+    def test_detect_many(self):
+        blobs = [('foo.rb', 'module Foo\nend\n', None),
+                 ('hello.h', '@interface Foo : NSObject\n@end\n', None),
+                 ('hello.h', '', None),
+                 ('foo.nkt', 'foo', None),
+                 ('hello.h', lambda: 'class Bar {\n protected:\n  char *name;\n};\n', None)]
+        expected = [Language.detect(name, data, mode) for name, data, mode in blobs]
+        assert expected == Language.detect_many(blobs)
+        assert [Language['Ruby'], Language['Objective-C'], None, None, Language['C++']] == expected
+
+        Classifier.matrix = True
+        try:
+            assert expected == Language.detect_many(blobs)
+        finally:
+            Classifier.matrix = False
+
+    def test_candidate_sets(self):
+        candidate_sets = Language.candidate_sets()
+        assert ['C', 'C++', 'Objective-C'] in candidate_sets
+        assert ['Perl', 'Prolog'] in candidate_sets
+        assert ['Ruby'] not in candidate_sets
+        # samples.model ships the index of every set
+        shipped = Samples.model().candidate_indexes
+        assert sorted(candidate_sets) == sorted([list(languages) for languages, index in shipped.values()])
+
     def test_find(self):
         assert 'Ruby' == Language['Ruby'].name
         assert 'Ruby' == Language['ruby'].name
@@ -307,6 +338,73 @@ class TestLanguage(LinguistTestBase):
         assert Language['Ruby'] == Language['Ruby']
         assert Language['Ruby'] != Language['Python']
 
+    def test_reload(self):
+        fd, path = tempfile.mkstemp(suffix='.model')
+        os.close(fd)
+        model = Samples.model()
+        candidate_sets = Language.candidate_sets()
+        try:
+            db = model.to_db()
+            db['extnames'] = dict(db['extnames'])
+            db['extnames']['Ruby'] = db['extnames']['Ruby'] + ['.rubyx']
+            retrained = Model.from_db(db)
+            retrained.md5 = Samples.digest(retrained)
+            retrained.dump(path)
+
+            self.assertRaises(ValueError, Language.reload, path, model.md5)
+            reloaded = Language.reload(path, retrained.md5)
+            assert reloaded is Samples.model()
+            assert [Language['Ruby']] == Language.find_by_filename('foo.rubyx')
+            assert '.rubyx' in Language['Ruby'].extensions
+            assert Classifier.load(reloaded).candidate_indexes
+            assert Language['Objective-C'] == Language.detect('Foo.h', open('../samples/Objective-C/Foo.h').read())
+
+            # A file that doesn't match its md5 is refused
+            data = bytearray(open(path, 'rb').read())
+            data[reloaded.posting_counts.offset] ^= 1
+            open(path, 'wb').write(str(data))
+            self.assertRaises(ValueError, Language.reload, path)
+            assert reloaded is Samples.model()
+
+            # So is a truncated one
+            for size in (len(data) - 1, 10, 0):
+                open(path, 'wb').write(str(data[:size]))
+                self.assertRaises(ValueError, Language.reload, path)
+                assert reloaded is Samples.model()
+        finally:
+            os.remove(path)
+            Language.reload(MODEL_PATH)
+        assert model.md5 == Samples.model().md5
+        assert [] == Language.find_by_filename('foo.rubyx')
+        assert candidate_sets == Language.candidate_sets()
+
+    def test_reload_detect_many(self):
+        fd, path = tempfile.mkstemp(suffix='.model')
+        os.close(fd)
+        model = Samples.model()
+        try:
+            db = model.to_db()
+            # A model without Perl
+            db['tokens_total'] -= db['language_tokens'].pop('Perl')
+            db['languages_total'] -= db['languages'].pop('Perl')
+            del db['tokens']['Perl']
+            db['extnames'] = dict(db['extnames'])
+            del db['extnames']['Perl']
+            retrained = Model.from_db(db)
+            retrained.md5 = Samples.digest(retrained)
+            retrained.dump(path)
+            Language.reload(path)
+
+            data = open('../samples/Prolog/quicksort.pl').read()
+            assert [Language['Perl'], Language['Prolog']] == sorted(Language.find_by_filename('foo.pl'))
+            assert Language['Prolog'] == Language.detect('foo.pl', data)
+            assert [Language['Prolog'], None] == Language.detect_many([('foo.pl', data, None),
+                                                                       ('bar.pl', '', None)])
+        finally:
+            os.remove(path)
+            Language.reload(MODEL_PATH)
+        assert model.md5 == Samples.model().md5
+
     def test_colorize(self):
         assert colorize == Language['Ruby'].colorize("def foo\n  'foo'\nend\n")
 
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from framework import LinguistTestBase, main
+from libs.classifier import Classifier
+from libs.matrix_classifier import MatrixClassifier
+from libs.samples import DATA
+
+TEST_FILE = "../samples/%s"
+
+
+class TestMatrixClassifier(LinguistTestBase):
+
+    def fixture(self, name):
+        return open(TEST_FILE % name).read()
+
+    def test_classify(self):
+        if not MatrixClassifier.available:
+            return
+        db = {}
+        Classifier.train(db, "Ruby", self.fixture("Ruby/foo.rb"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.h"))
+        Classifier.train(db, "Objective-C", self.fixture("Objective-C/Foo.m"))
+
+        rs = MatrixClassifier(db).classify([self.fixture("Objective-C/hello.m"),
+                                            self.fixture("Ruby/foo.rb")])
+        assert "Objective-C" == rs[0][0][0]
+        assert "Ruby" == rs[1][0][0]
+
+        rs = MatrixClassifier(db).classify([self.fixture("Objective-C/hello.m")], ["Ruby"])
+        assert [["Ruby"]] == [[l for l, _ in r] for r in rs]
+
+    def test_matches_classifier(self):
+        if not MatrixClassifier.available:
+            return
+        names = ["C/hello.h", "C++/bar.h", "Objective-C/Foo.h", "Perl/fib.pl", "Prolog/turing.pl"]
+        documents = [self.fixture(name) for name in names] + ["", None]
+        languages = ["C", "C++", "Objective-C", "Perl", "Prolog"]
+
+        rs = MatrixClassifier.load(DATA).classify(documents, languages)
+        for document, r in zip(documents, rs):
+            expected = dict(Classifier.classify(DATA, document, languages))
+            assert sorted(expected) == sorted(dict(r))
+            for language, score in r:
+                assert abs(score - expected[language]) < 1e-6
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+from os.path import join, splitext
+
+from framework import LinguistTestBase, main
+from libs.classifier import Classifier
+from libs.model import Model, HashedModel, MappedModel
+from libs.samples import DATA, Samples
+from libs.tokenizer import Tokenizer
+
+
+class TestModel(LinguistTestBase):
+
+    def test_from_db(self):
+        model = Model.from_db(DATA)
+        assert sorted(DATA['languages']) == model.languages
+        assert DATA['tokens_total'] == model.tokens_total
+        assert DATA['languages_total'] == model.languages_total
+        assert len(model.tokens) + 1 == len(model.offsets)
+        assert sum([len(t) for t in DATA['tokens'].values()]) == len(model.posting_counts)
+
+        for language, tokens in DATA['tokens'].iteritems():
+            language_id = model.language_ids[language]
+            assert DATA['language_tokens'][language] == model.language_tokens[language_id]
+            assert DATA['languages'][language] == model.language_counts[language_id]
+            for token, count in tokens.iteritems():
+                assert count == model.count(token, language)
+
+    def test_count(self):
+        model = Model.from_db(DATA)
+        assert 0 == model.count('not-a-known-token', 'Ruby')
+        assert 0 == model.count('@interface', 'not-a-known-language')
+        assert model.count('@interface', 'Objective-C') > 0
+        assert 0 == model.count('@interface', 'Ruby')
+
+    def test_load(self):
+        assert Model.load(DATA) is Model.load(DATA)
+
+    def test_dump(self):
+        db = {}
+        Classifier.train(db, "Ruby", "def hello; end")
+        Classifier.train(db, "Python", "def hello(): pass # caf\xc3\xa9")
+        model = Model.from_db(db)
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            model.dump(path)
+            mapped = MappedModel.open(path)
+            data = open(path, 'rb').read()
+        finally:
+            os.remove(path)
+
+        for size in (len(data) - 1, len(data) / 2, 10):
+            self.assertRaises(ValueError, MappedModel, data[:size])
+        assert model.languages == mapped.languages
+        assert model.size == mapped.size
+        assert model.tokens_total == mapped.tokens_total
+        assert list(model.log_probabilities) == list(mapped.log_probabilities)
+        assert list(model.token_gaps) == list(mapped.token_gaps)
+        for token_id, token in enumerate(model.tokens):
+            assert token == mapped.token(token_id)
+            assert token_id == mapped.token_id(token)
+        assert None == mapped.token_id('not-a-known-token')
+        data = "def hello(): caf\xc3\xa9 unknown"
+        assert Classifier(model).count_token_ids(data) == Classifier(mapped).count_token_ids(data)
+        assert 1 == mapped.count('hello', 'Ruby')
+        assert 0 == mapped.count('pass', 'Ruby')
+
+    def test_non_ascii_tokens(self):
+        data = open("../samples/Ruby/inflector.rb").read()
+        token = "<!['\xe2\x80\x99`])[a-z]/)>"
+        assert token in Tokenizer.tokenize(data)
+        db = {}
+        Classifier.train(db, "Ruby", data)
+        Classifier.train(db, "Python", "def hello(): pass")
+        loaded = json.loads(json.dumps(db))
+        assert token.decode('utf-8') in loaded['tokens']['Ruby']
+
+        model = Model.from_db(loaded)
+        assert 1 == model.count(token, "Ruby")
+        assert model.token_id(token) is not None
+        expected = dict(Classifier(db)._classify(data, ["Ruby", "Python"]))
+        for language, score in Classifier(model)._classify(data, ["Ruby", "Python"]):
+            assert abs(score - expected[language]) < 1e-9
+
+    def test_mapped_model(self):
+        model = Samples.model()
+        assert DATA['md5'] == model.md5
+        assert sorted(DATA['languages']) == model.languages
+        assert DATA['extnames'] == model.metadata['extnames']
+        for language, tokens in DATA['tokens'].iteritems():
+            for token, count in tokens.items()[:20]:
+                assert count == model.count(token, language)
+
+        data = open("../samples/Objective-C/Foo.h").read()
+        languages = ["C", "C++", "Objective-C"]
+        expected = dict(Classifier.classify(DATA, data, languages))
+        for language, score in Classifier.classify(model, data, languages):
+            assert abs(score - expected[language]) < 1e-9
+
+    def test_candidate_indexes(self):
+        db = {}
+        Classifier.train(db, "Ruby", open("../samples/Ruby/foo.rb").read())
+        Classifier.train(db, "Objective-C", open("../samples/Objective-C/Foo.h").read())
+        Classifier.train(db, "C", open("../samples/C/hello.c").read())
+        model = Model.from_db(db)
+        classifier = Classifier(model)
+        classifier.build_candidate_indexes([["C", "Objective-C"], ["C", "Objective-C", "Ruby"],
+                                            ["C", "Not-a-language"]])
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            model.dump(path, classifier.candidate_indexes)
+            mapped = MappedModel.open(path, copy=False)
+        finally:
+            os.remove(path)
+
+        assert 2 == len(mapped.candidate_indexes)
+        for languages in (["C", "Objective-C"], ["C", "Objective-C", "Ruby"]):
+            expected_languages, expected = classifier.candidate_indexes[frozenset(languages)]
+            mapped_languages, index = mapped.candidate_indexes[frozenset(languages)]
+            assert expected_languages == mapped_languages
+            assert len(expected) == len(index)
+            for token_id, (gap, row) in expected.iteritems():
+                assert (gap, tuple(row)) == index.get(token_id)
+            assert None == index.get(None)
+            assert None == index.get(model.size)
+
+        assert Classifier(mapped).candidate_indexes == mapped.candidate_indexes
+        data = open("../samples/Objective-C/hello.m").read()
+        for languages in (["C", "Objective-C"], ["C", "Objective-C", "Ruby"]):
+            assert classifier._classify_top(data, languages) == Classifier(mapped)._classify_top(data, languages)
+        assert 1 == mapped.count("@interface", "Objective-C")
+
+    def test_hashed_model(self):
+        db = {}
+        Classifier.train(db, "Ruby", "def hello; end")
+        Classifier.train(db, "Python", "def hello(): pass")
+        model = HashedModel.from_db(db, 2)
+        assert 2 == model.size
+        assert model.token_id("def") in (0, 1)
+        assert model.token_id("not-a-known-token") in (0, 1)
+        # Every token of a bucket counts for all of them
+        assert model.count("def", "Ruby") >= 1
+        assert sum([model.count(token, "Python") for token in ("def", "hello", "(", ")", "pass")]) >= 5
+        self.assertRaises(ValueError, HashedModel.from_db, db, 3)
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            model.dump(path)
+            mapped = MappedModel.open(path)
+        finally:
+            os.remove(path)
+        assert mapped.hashed
+        assert model.token_id("pass") == mapped.token_id("pass")
+        assert model.count("def", "Ruby") == mapped.count("def", "Ruby")
+        self.assertRaises(KeyError, mapped.token, 0)
+
+    def test_hashed_model_accuracy(self):
+        # Track how often the hashed model agrees with the exact one on
+        # samples with ambiguous extensions
+        exact, hashed = Model.load(DATA), HashedModel.from_db(DATA)
+        candidates = {'.h': ["C", "C++", "Objective-C"], '.pl': ["Perl", "Prolog"],
+                      '.m': ["Objective-C", "Matlab"]}
+        total = agree = 0
+        for language in ("C", "C++", "Objective-C", "Perl", "Prolog", "Matlab"):
+            for name in sorted(os.listdir(join("../samples", language))):
+                languages = candidates.get(splitext(name)[1])
+                if languages is None:
+                    continue
+                data = open(join("../samples", language, name)).read()
+                total += 1
+                agree += (Classifier.classify_top(exact, data, languages) ==
+                          Classifier.classify_top(hashed, data, languages))
+        assert total > 40
+        assert agree == total, (agree, total)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 
 from pygments.lexers import find_lexer_class
 from framework import LinguistTestBase, main, ROOT_DIR
+from libs import repository
 from libs.repository import Repository
 from libs.language import Language
 
@@ -25,6 +26,20 @@ class TestRepository(LinguistTestBase):
     def test_binary_override(self):
         assert self.repo(ROOT_DIR + '/samples/Nimrod').language == Language.find_by_name('Nimrod')
 
+    def test_batch_bytes(self):
+        expected = self.repo(ROOT_DIR + '/samples/C').languages
+        batches, add_blobs, batch_bytes = [], Repository.add_blobs, repository.BATCH_BYTES
+        Repository.add_blobs = lambda self, blobs: batches.append(len(blobs)) or add_blobs(self, blobs)
+        repository.BATCH_BYTES = 1
+        try:
+            assert expected == self.repo(ROOT_DIR + '/samples/C').languages
+        finally:
+            Repository.add_blobs = add_blobs
+            repository.BATCH_BYTES = batch_bytes
+        # Every blob is detected on its own, the last batch is empty
+        assert len(batches) > 2
+        assert [1] * (len(batches) - 1) + [0] == batches
+
 
 if __name__ == '__main__':
     main()
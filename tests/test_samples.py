@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import json
+import os
+import tempfile
+
 from framework import LinguistTestBase, main
-from libs.samples import DATA
+from libs import samples as samples_module
+from libs.classifier import Classifier
+from libs.md5 import MD5
+from libs.model import HashedModel, MappedModel
+from libs.samples import DATA, MODEL_PATH, PATH, Database, Samples
 
 
 class TestSamples(LinguistTestBase):
@@ -13,5 +21,116 @@ class TestSamples(LinguistTestBase):
         assert data['tokens_total'] == sum(reduce(lambda x, y: x + y,
                                                   [token.values() for token in data['tokens'].values()]))
 
+    def test_lazy(self):
+        data = Database(PATH)
+        assert not data.loaded
+        assert DATA['md5'] == data['md5']
+        assert data.loaded
+
+        # Nothing sees it empty before it's loaded
+        data = Database(PATH)
+        assert data.load() == dict(data)
+        data = Database(PATH)
+        self.assertRaises(TypeError, json.dumps, data)
+        self.assertRaises(TypeError, MD5.hexdigest, data)
+        assert not hasattr(data, '__setitem__')
+        assert not hasattr(data, 'update')
+
+    def test_metadata(self):
+        metadata = Samples.metadata()
+        assert DATA['extnames'] == metadata['extnames']
+        assert DATA['filenames'] == metadata['filenames']
+
+    def test_model(self):
+        assert Samples.model() is Samples.model()
+        assert DATA['md5'] == Samples.model().md5
+
+    def test_publish(self):
+        fd, path = tempfile.mkstemp(suffix='.model')
+        os.close(fd)
+        model = Samples.model()
+        try:
+            Samples.publish(path, [["C", "C++", "Objective-C"], ["Perl", "Prolog"]])
+            attached = Samples.attach(path)
+            assert attached is Samples.model()
+            assert model.md5 == attached.md5
+            assert 2 == len(attached.candidate_indexes)
+
+            data = open("../samples/Objective-C/Foo.h").read()
+            languages = ["C", "C++", "Objective-C"]
+            assert "Objective-C" == Classifier.classify_top(attached, data, languages)
+            assert Classifier.classify(model, data, languages) == Classifier.classify(attached, data, languages)
+        finally:
+            Samples._model = model
+            os.remove(path)
+
+    def test_open(self):
+        db = {}
+        Classifier.train(db, "Ruby", "def hello; end")
+        Classifier.train(db, "Python", "def hello(): pass")
+        db['md5'] = MD5.hexdigest(db)
+        hashed = HashedModel.from_db(db, 1 << 4)
+        classifier = Classifier(hashed)
+        classifier.build_candidate_indexes([["Python", "Ruby"]])
+
+        fd, path = tempfile.mkstemp(suffix='.model')
+        os.close(fd)
+        try:
+            hashed.dump(path, classifier.candidate_indexes)
+            model = Samples.open(path, db['md5'])
+            assert model.verify()
+            data = bytearray(open(path, 'rb').read())
+
+            # Hashed files are checked for more than their md5
+            index = model.candidate_indexes[frozenset(["Python", "Ruby"])][1]
+            for offset in (model.posting_counts.offset, model.log_probabilities.offset, index.gaps):
+                corrupted = data[:]
+                corrupted[offset] ^= 1
+                open(path, 'wb').write(str(corrupted))
+                assert not MappedModel.open(path).verify()
+                self.assertRaises(ValueError, Samples.open, path, db['md5'])
+        finally:
+            os.remove(path)
+
+    def test_merge(self):
+        samples = []
+        Samples.each(lambda sample: sample['language'] in ('Ruby', 'Python', 'Perl') and
+                     samples.append(sample))
+        db = Samples.train(samples)
+        db['md5'] = MD5.hexdigest(db)
+
+        partials = [Samples.train(samples[1::2]), Samples.train(samples[::2])]
+        assert db['md5'] == Samples.merge(partials)['md5']
+        partials = [json.loads(json.dumps(partial)) for partial in partials]
+        assert db == Samples.merge(partials)
+
+    def test_generate(self):
+        db = {}
+        Classifier.train(db, "Ruby", "def hello; end")
+        Classifier.train(db, "Python", "def hello(): pass")
+        db['md5'] = MD5.hexdigest(db)
+
+        paths = []
+        for suffix in ('.json', '.model'):
+            fd, path = tempfile.mkstemp(suffix=suffix)
+            os.close(fd)
+            paths.append(path)
+        calls = []
+        data = Samples.__dict__['data']
+        Samples.data = classmethod(lambda cls, processes=1: calls.append(processes) or db)
+        samples_module.PATH, samples_module.MODEL_PATH = paths
+        try:
+            Samples.generate(processes=4, candidate_sets=[["Ruby", "Python"]])
+            assert [4] == calls
+            assert db == json.load(open(paths[0]))
+            model = MappedModel.open(paths[1])
+            assert db['md5'] == model.md5
+            assert [frozenset(["Python", "Ruby"])] == model.candidate_indexes.keys()
+        finally:
+            Samples.data = data
+            samples_module.PATH, samples_module.MODEL_PATH = PATH, MODEL_PATH
+            for path in paths:
+                os.remove(path)
+
 if __name__ == '__main__':
     main()
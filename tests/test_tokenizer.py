@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
+from mmap import mmap, ACCESS_READ
 from os.path import join
 from framework import LinguistTestBase, main, ROOT_DIR
-from libs.tokenizer import Tokenizer
+from libs.tokenizer import Tokenizer, BYTE_LIMIT, READ_AHEAD, READ_SIZE, is_py27
 
 
 class TestTokenizer(LinguistTestBase):
@@ -43,6 +44,16 @@ class TestTokenizer(LinguistTestBase):
         assert r1 == self.tokenize("foo (* Comment *)")
         assert r3 == self.tokenize("2 % 10\n% Comment")
 
+    def test_skip_edge_cases(self):
+        # Single line comments only start a line
+        assert ['foo', '#', 'not', 'a', 'comment', 'bar'] == self.tokenize("foo  # not a comment\n  # comment\nbar")
+        assert ['x', '+', 'y'] == self.tokenize('x = "a \\" b" + y')
+        # Unclosed strings and comments only skip their opening token
+        assert ['f', '(', 'unclosed', 'g', ')'] == self.tokenize('f("unclosed, g)')
+        assert ['unclosed', 'foo'] == self.tokenize("/* unclosed\nfoo")
+        assert ['a#', 'b', 'c', 'd'] == self.tokenize("a#!b c\nd")
+        assert ['x', 'y', 'z', 'xff'] == self.tokenize("x, y: z != 0xff")
+
     def test_sgml_tags(self):
         assert ["<html>", "</html>"] == self.tokenize("<html> </html>")
         assert ["<div>", "id", "</div>"] == self.tokenize("<div id></div>")
@@ -51,6 +62,7 @@ class TestTokenizer(LinguistTestBase):
         assert ["<div>", "id=", "</div>"] == self.tokenize("<div id=\"foo bar\"></div>")
         assert ["<div>", "id=", "</div>"] == self.tokenize("<div id='foo bar'></div>")
         assert ["<?xml>", "version="] == self.tokenize("<?xml version=\"1.0\"?>")
+        assert ["<a>", "href=", "b=", "y", "c=", "d"] == self.tokenize("<a href=\"x\" b='y c=z>d")
 
     def test_operators(self):
         assert ["+"] == self.tokenize("1 + 1")
@@ -109,6 +121,92 @@ class TestTokenizer(LinguistTestBase):
         assert "module Foo end".split() == self.tokenize("Ruby/foo.rb", True)
         assert "task default do puts end".split(), self.tokenize("Ruby/filenames/Rakefile", True)
 
+    def test_iter_tokens(self):
+        data = open(join(join(ROOT_DIR, "samples"), "XML/module.ivy")).read()
+        tokens = Tokenizer.iter_tokens(data)
+        assert Tokenizer.tokenize(data) == list(tokens)
+        assert [] == list(tokens)
+
+        tokens = Tokenizer.iter_tokens('<div id class=foo></div> int x;')
+        assert ['<div>', 'id'] == [tokens.next() for i in xrange(2)]
+        assert ['class=', '</div>', 'int', 'x', ';'] == list(tokens)
+
+    def test_count_tokens(self):
+        data = open(join(join(ROOT_DIR, "samples"), "Objective-C/hello.m")).read()
+        tokens = Tokenizer.tokenize(data)
+        counts = Tokenizer.count_tokens(data)
+        assert sorted(set(tokens)) == sorted(counts)
+        for token, count in counts.iteritems():
+            assert tokens.count(token) == count
+
+        assert {'int': 2, 'x': 1, ';': 2} == Tokenizer.count_tokens("int x; int y;", 3)
+        assert {} == Tokenizer.count_tokens("int x;", 0)
+
+    def test_count_token_ids(self):
+        assert ({0: 2, 1: 2}, 6) == Tokenizer.count_token_ids("int x; int y;", {'int': 0, ';': 1})
+        assert ({0: 4}, 6) == Tokenizer.count_token_ids(u"int x; int y;", lambda t: 0 if t in ('int', ';') else None)
+        assert ({}, 0) == Tokenizer.count_token_ids("", {'int': 0})
+
+    def test_buffers(self):
+        path = join(join(ROOT_DIR, "samples"), "Objective-C/hello.m")
+        data = open(path).read()
+        f = open(path)
+        try:
+            mapped = mmap(f.fileno(), 0, access=ACCESS_READ)
+        finally:
+            f.close()
+        buffers = [buffer, bytearray]
+        if is_py27:
+            buffers.append(memoryview)
+        for buf in [make(data) for make in buffers] + [mapped]:
+            tokens = Tokenizer.tokenize(buf)
+            assert Tokenizer.tokenize(data) == tokens
+            assert [str] == list(set(map(type, tokens)))
+        mapped.close()
+
+        data = '/* %s */ "%s" int x;' % ('x' * 100, 'y' * 100)
+        assert ['int', 'x', ';'] == Tokenizer.tokenize(buffer(data))
+
+        # A string running across the limit is skipped whole
+        data = 'int x; "%s" int y;' % ('z' * (BYTE_LIMIT + READ_AHEAD))
+        assert ['int', 'x', ';'] == Tokenizer.tokenize(data)
+        for make in buffers:
+            assert Tokenizer.tokenize(data) == Tokenizer.tokenize(make(data))
+
+    def test_read(self):
+        path = join(join(ROOT_DIR, "samples"), "C/hello.h")
+        data = open(path).read()
+        assert data == Tokenizer.read(open(path))
+        assert data == Tokenizer.read(iter([data[:10], data[10:]]))
+        assert data[:15] == Tokenizer.read(iter([data[:10], data[10:]]), 15)
+
+        chunks = iter(['int x;\n'] * BYTE_LIMIT)
+        assert BYTE_LIMIT + READ_AHEAD == len(Tokenizer.read(chunks))
+        # What is left past the limit isn't consumed
+        assert 'int x;\n' == chunks.next()
+
+    def test_tokenize_stream(self):
+        path = join(join(ROOT_DIR, "samples"), "Objective-C/Foo.m")
+        assert self.tokenize("Objective-C/Foo.m", True) == Tokenizer.tokenize_stream(open(path))
+
+        data = 'int x; /* comment */\n' * (2 * BYTE_LIMIT / 22)
+        chunks = [data[i:i + 1000] for i in xrange(0, len(data), 1000)]
+        assert Tokenizer.tokenize(data) == Tokenizer.tokenize_stream(chunks)
+
+    def test_stream_tokens(self):
+        path = join(join(ROOT_DIR, "samples"), "Objective-C/Foo.m")
+        assert self.tokenize("Objective-C/Foo.m", True) == list(Tokenizer.stream_tokens(open(path)))
+
+        data = '/* a comment\n running across chunks */ "and a string" int x;\n' * 1000
+        chunks = [data[i:i + 100] for i in xrange(0, len(data), 100)]
+        assert Tokenizer.tokenize(data) == list(Tokenizer.stream_tokens(chunks))
+
+        stream = iter(chunks)
+        tokens = Tokenizer.stream_tokens(stream)
+        assert ['int', 'x', ';'] == [tokens.next() for i in xrange(3)]
+        # Only the first READ_SIZE bytes were read
+        assert len(chunks) - len(list(stream)) == READ_SIZE / 100 + 1
+
 
 if __name__ == '__main__':
     main()